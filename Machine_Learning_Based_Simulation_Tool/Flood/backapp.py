@@ -1,14 +1,18 @@
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 import os
+import sys
 import pickle
 import pandas as pd
 import numpy as np
 from sklearn.metrics import mean_absolute_error, mean_squared_error, r2_score
-from itertools import product
-from sklearn.model_selection import TimeSeriesSplit
 from prophet import Prophet
 
+# share the artifact cache helpers with the main service
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from utils.prophet_cache import load_or_fit_helper_models
+from utils.prophet_search import search_prophet_params
+
 app = Flask(__name__)
 CORS(app, resources={
     r"/*": {
@@ -20,6 +24,11 @@ CORS(app, resources={
 
 MODEL_FILE = "prophet_model.pkl"
 TRAIN_FILE = "prophet_train.csv"
+SEARCH_CHECKPOINT_FILE = "prophet_search_scores.jsonl"
+
+# grid-search settings: worker processes (1 = sequential) and optional early-pruning factor
+SEARCH_N_JOBS = int(os.environ.get("PROPHET_SEARCH_JOBS", os.cpu_count() or 1))
+SEARCH_PRUNE_FACTOR = float(os.environ["PROPHET_SEARCH_PRUNE"]) if os.environ.get("PROPHET_SEARCH_PRUNE") else None
 
 # Global variables
 temperature_model = None
@@ -222,40 +231,16 @@ def load_and_train_model():
             if reg in train_data.columns:
                 prophet_train[reg] = train_data[reg]
 
-        # Hyperparameter tuning with time series cross-validation
-        tscv = TimeSeriesSplit(n_splits=2)
+        # Hyperparameter tuning with time series cross-validation (parallel, resumable)
         param_grid = {
             "changepoint_prior_scale": [0.01, 0.1, 0.5, 1.0],
             "seasonality_prior_scale": [0.1, 1.0, 5.0, 10.0]
         }
-        best_params = None
-        best_score = float("inf")
-
-        for cps, sps in product(param_grid["changepoint_prior_scale"], param_grid["seasonality_prior_scale"]):
-            cv_scores = []
-            for train_idx, val_idx in tscv.split(prophet_train):
-                train_cv = prophet_train.iloc[train_idx]
-                val_cv = prophet_train.iloc[val_idx]
-                
-                model_cv = Prophet(
-                    changepoint_prior_scale=cps,
-                    seasonality_prior_scale=sps,
-                    daily_seasonality=True
-                )
-                # Add all extra regressors
-                for reg in additional_regressors:
-                    if reg in prophet_train.columns:
-                        model_cv.add_regressor(reg)
-                
-                model_cv.fit(train_cv)
-                forecast_cv = model_cv.predict(val_cv)
-                mae = mean_absolute_error(val_cv["y"], forecast_cv["yhat"])
-                cv_scores.append(mae)
-            
-            avg_cv_score = np.mean(cv_scores)
-            if avg_cv_score < best_score:
-                best_score = avg_cv_score
-                best_params = (cps, sps)
+        best_params, best_score = search_prophet_params(
+            prophet_train, additional_regressors, param_grid, n_splits=2,
+            n_jobs=SEARCH_N_JOBS, checkpoint_file=SEARCH_CHECKPOINT_FILE,
+            prune_factor=SEARCH_PRUNE_FACTOR
+        )
 
         optimal_changepoint_prior_scale, optimal_seasonality_prior_scale = best_params
         print(f"Optimal Hyperparameters: changepoint_prior_scale={optimal_changepoint_prior_scale}, "
@@ -298,32 +283,23 @@ def load_and_train_model():
         prophet_train.to_csv(TRAIN_FILE, index=False)
         print("Water area model training complete. Saved to disk.")
 
-    # Train separate models for extra regressors (temperature, humidity, rainfall)
-    if "Average_Temperature" in prophet_train.columns:
-        temp_df = prophet_train[["ds", "Average_Temperature"]].dropna().rename(columns={"Average_Temperature": "y"})
-        temperature_model = Prophet(daily_seasonality=True)
-        temperature_model.fit(temp_df)
-        print("Temperature model trained.")
-
-    if "Average_Humidity" in prophet_train.columns:
-        hum_df = prophet_train[["ds", "Average_Humidity"]].dropna().rename(columns={"Average_Humidity": "y"})
-        humidity_model = Prophet(daily_seasonality=True)
-        humidity_model.fit(hum_df)
-        print("Humidity model trained.")
-
-    if "Rainfall" in prophet_train.columns:
-        rain_df = prophet_train[["ds", "Rainfall"]].dropna().rename(columns={"Rainfall": "y"})
-        rainfall_model = Prophet(daily_seasonality=True)
-        rainfall_model.fit(rain_df)
-        print("Rainfall model trained.")
+    # Separate models for extra regressors (temperature, humidity, rainfall),
+    # reloaded from the artifact cache unless prophet_train.csv has changed
+    helpers = load_or_fit_helper_models(prophet_train, TRAIN_FILE, os.path.dirname(os.path.abspath(MODEL_FILE)))
+    temperature_model = helpers["temperature"]
+    humidity_model = helpers["humidity"]
+    rainfall_model = helpers["rainfall"]
     
     return {"model": model, "prophet_train": prophet_train}
 
 
-# Initialize / train the model(s) at startup
-model_info = load_and_train_model()
-prophet_model = model_info["model"]
-prophet_train = model_info["prophet_train"]
+# Initialize / train the model(s) at startup.
+# Skipped in the grid-search worker processes, which re-import this module
+# as __mp_main__ on spawn-based platforms (Windows, macOS).
+if __name__ != "__mp_main__":
+    model_info = load_and_train_model()
+    prophet_model = model_info["model"]
+    prophet_train = model_info["prophet_train"]
 
 
 @app.route('/predict', methods=['GET'])
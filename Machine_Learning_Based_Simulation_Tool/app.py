@@ -1,20 +1,29 @@
 from flask import Flask, request, jsonify
-import atexit
+import numpy as np
 import os
-import shutil
 import json
 import base64
 from io import BytesIO
 from PIL import Image, ImageDraw, ImageFont
 from numpyencoder import NumpyEncoder
 from werkzeug.exceptions import HTTPException
-from utils.meander_migration import return_to_hp, get_raw_predictions
-from utils.meander_migration_xai import clear_images, send_map_to_api
-from utils.com_cache import m_cache, init_cache, data_cache
-from utils.riverbank_erosion import load_resources, prepare_future_input, make_predictions
+from utils.meander_migration import return_to_hp, meander_ensemble, ENSEMBLE_MAX_MEMBERS, ENSEMBLE_PERTURBATIONS
+from utils.meander_migration_xai import send_map_to_api, send_saliency_tensor
+from utils.meander_migration_visualization import get_centerline_trajectory
+from utils.shared_cache import shared_cache
+from utils.model_registry import get_model, model_stats, refresh_model, is_loaded
+from utils.riverbank_erosion import (prepare_future_input, make_predictions, prepare_future_input_batch,
+                                     make_predictions_batch, quarter_span, TARGETS, SENSITIVITY_FEATURES,
+                                     feature_sensitivity_finite_difference, feature_sensitivity_jacobian,
+                                     render_sensitivity_png, predict_dense, make_predictions_cached,
+                                     prediction_cache)
 from utils.riverbank_erosion_xai import generate_heatmap_with_timesteps
-from utils.simulation_tool import load_resource_simulation , make_prediction_simulation, prepare_future_input_simulation
+from utils.simulation_tool import (make_prediction_simulation, make_prediction_simulation_cached,
+                                   prepare_future_input_simulation, prepare_future_input_simulation_batch,
+                                   simulation_prediction_cache, simulation_target_names)
 from utils.simulation_tool_xai import *
+from utils.simulation_surrogate import make_prediction_simulation_surrogate
+from utils.FloodLogic import flood_prediction_logic, get_forecast_table, EXPLAIN_MODES
 from flask_cors import CORS
 import traceback
 
@@ -23,37 +32,28 @@ import traceback
 
 app = Flask(__name__)
 CORS(app, resources={r"/*": {"origins": "http://localhost:3000"}}, supports_credentials=True)
-init_cache(app)
 
-# Load resources (model and scalers) globally for riverbank erosion
-model, scalers, feature_cols,model_1, scaler_ts, scaler_year = load_resources()
+# Models and scalers are owned by utils/model_registry.py: each artifact is
+# loaded once per process, the first time an endpoint asks for it.
 
-# load resources 4 flood prediction
-prophet_model, prophet_train, temp_model, hum_model, rain_model = load_model()
-
-#load model for simulation
-simulation_model, scaler_features, scaler_targets = load_resource_simulation()
-
-#load model for simulation
-simulation_model, scaler_features, scaler_targets = load_resource_simulation()
-
-def clean_up():
-    IMAGE_FOLDER = r'data_dir\meander_migration_sal_maps'
-    if os.path.exists(IMAGE_FOLDER):
-        shutil.rmtree(IMAGE_FOLDER)  
-        print(f"Cleared all images in {IMAGE_FOLDER}")
-    
-    # Clear cache
-    m_cache.clear()
-    data_cache.clear()
-    print("Cleared all cache")
-    
-atexit.register(clean_up)
- 
 @app.route('/')
 def homepage():
     return 'Homepage'
 
+@app.get('/models/status')
+def get_model_status():
+    return jsonify(model_stats())
+
+@app.post('/models/refresh')
+def refresh_models():
+    # reload any loaded model whose artifact files were replaced on disk
+    reloaded = [name for name in model_stats()["models"] if is_loaded(name) and refresh_model(name)]
+    return jsonify({"reloaded": reloaded})
+
+@app.get('/shared_cache/stats')
+def get_shared_cache_stats():
+    return jsonify(shared_cache.stats())
+
 @app.get('/meander_migration/params/')
 def predict_meander():
     query = request.args.to_dict()
@@ -65,6 +65,51 @@ def predict_meander():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
     
+@app.get('/meander_migration/params/ensemble/')
+def predict_meander_ensemble():
+    # ?year=&quart=[&members=100&noise=0.05&perturb=input&percentiles=5,50,95&seed=]
+    query = request.args.to_dict()
+    try:
+        y = int(query['year'])
+        q = int(query['quart'])
+        members = int(query.get('members', 100))
+        noise = float(query.get('noise', 0.05))
+        perturb = query.get('perturb', 'input')
+        percentiles = [float(p) for p in query.get('percentiles', '5,50,95').split(',')]
+        seed = int(query['seed']) if 'seed' in query else None
+    except (KeyError, ValueError) as e:
+        return jsonify({'error': f'invalid query: {e}'}), 400
+
+    if y < 2025 or not 1 <= q <= 4:
+        return jsonify({'error': 'ensembles are only available for forecast quarters (2025-Q1 onwards)'}), 400
+    if not 1 <= members <= ENSEMBLE_MAX_MEMBERS:
+        return jsonify({'error': f'members must be between 1 and {ENSEMBLE_MAX_MEMBERS}'}), 400
+    if perturb not in ENSEMBLE_PERTURBATIONS:
+        return jsonify({'error': f"perturb must be one of {', '.join(ENSEMBLE_PERTURBATIONS)}"}), 400
+    if noise < 0 or not all(0 <= p <= 100 for p in percentiles):
+        return jsonify({'error': 'noise must be ≥ 0 and percentiles within [0, 100]'}), 400
+
+    try:
+        return jsonify(meander_ensemble(y, q, members, noise, perturb, percentiles, seed))
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.get('/meander_migration/params/centerline/')
+def get_centerline():
+    # every forecast quarter's centerline (pixels and lat/long) up to year / quart
+    query = request.args.to_dict()
+    try:
+        y = int(query['year'])
+        q = int(query['quart'])
+    except (KeyError, ValueError) as e:
+        return jsonify({'error': f'invalid query: {e}'}), 400
+    if y < 2025 or not 1 <= q <= 4:
+        return jsonify({'error': 'centerlines are only available for forecast quarters (2025-Q1 onwards)'}), 400
+    try:
+        return jsonify(get_centerline_trajectory(y, q))
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.get('/meander_migration/params/explain_migration/')
 def get_saliency():
     query = request.args.to_dict()
@@ -74,6 +119,19 @@ def get_saliency():
     map = send_map_to_api(y, q, map_idx)
     return map
 
+@app.get('/meander_migration/params/explain_migration/raw/')
+def get_saliency_tensor():
+    # ?year=&quart=[&start=0&stop=n_steps&format=json|binary]
+    query = request.args.to_dict()
+    try:
+        y = int(query['year'])
+        q = int(query['quart'])
+        start = int(query.get('start', 0))
+        stop = int(query['stop']) if 'stop' in query else None
+    except (KeyError, ValueError) as e:
+        return jsonify({'error': f'invalid query: {e}'}), 400
+    return send_saliency_tensor(y, q, start, stop, query.get('format', 'json'))
+
 # @app.get('/meander_migration/params/get_point_values/')
 # def get_raw_point_vals():
 #     query = request.args.to_dict()
@@ -102,8 +160,7 @@ def predict_erosion():
         if missing:
             return jsonify({"error": f"Missing fields: {', '.join(missing)}"}), 400
 
-        X = prepare_future_input(year, quarter, rainfall, temperature)
-        preds = make_predictions(X)
+        preds = make_predictions_cached(year, quarter, rainfall, temperature)
 
         return jsonify({
             "year"        : year,
@@ -116,6 +173,10 @@ def predict_erosion():
     except Exception as exc:
         return jsonify({"error": str(exc)}), 500
 
+@app.get("/predict_erosion/cache_stats")
+def erosion_cache_stats():
+    return jsonify(prediction_cache.stats())
+
 @app.route("/predict_erosion/heatmap", methods=["POST"])
 def predict_heatmap():
     try:
@@ -131,12 +192,13 @@ def predict_heatmap():
 
         # Generate heatmap
         b64_png = generate_heatmap_with_timesteps(
-            model=model_1,
+            model=get_model("erosion_nn"),
             start_year=year,
             start_quarter=quarter,
-            scaler_year=scaler_year,
+            scaler_year=get_model("scaler_year"),
             points=points,
-            timesteps=timesteps
+            timesteps=timesteps,
+            predict_fn=lambda X: predict_dense("erosion_nn", X)
         )
 
         return jsonify({
@@ -150,6 +212,98 @@ def predict_heatmap():
     except Exception as exc:
         return jsonify({"error": str(exc), "trace": traceback.format_exc()}), 500
     
+# quarters per sensitivity request; each one costs 5 (finite difference)
+# or a Jacobian's worth of forward passes
+SENSITIVITY_MAX_QUARTERS = int(os.environ.get("SENSITIVITY_MAX_QUARTERS", 400))
+
+@app.route("/predict_erosion/sensitivity", methods=["POST"])
+def predict_sensitivity():
+    try:
+        data = request.get_json(force=True)
+
+        # a single quarter (year/quarter) or a span (startYear … endQuarter)
+        if "endYear" in data:
+            start_year, start_quarter = int(data.get("startYear", 2025)), int(data.get("startQuarter", 1))
+            end_year, end_quarter = int(data["endYear"]), int(data["endQuarter"])
+        else:
+            start_year, start_quarter = int(data["year"]), int(data["quarter"])
+            end_year, end_quarter = start_year, start_quarter
+        if not (1 <= start_quarter <= 4 and 1 <= end_quarter <= 4):
+            return jsonify({"error": "quarters must be between 1 and 4"}), 400
+        n_quarters = (end_year*4 + end_quarter) - (start_year*4 + start_quarter) + 1
+        if n_quarters < 1:
+            return jsonify({"error": "start date must be ≤ end date"}), 400
+        if n_quarters > SENSITIVITY_MAX_QUARTERS:
+            return jsonify({"error": f"at most {SENSITIVITY_MAX_QUARTERS} quarters per request"}), 400
+        years, quarters = quarter_span(start_year, start_quarter, end_year, end_quarter)
+
+        rainfall    = float(data.get("rainfall",    0.35))
+        temperature = float(data.get("temperature", 301.8))
+        points      = list(map(int, data.get("points", range(1, len(TARGETS) + 1))))
+        mode        = data.get("mode", "finite_difference")
+        want_png    = bool(data.get("png", False))
+
+        if not all(1 <= p <= len(TARGETS) for p in points):
+            return jsonify({"error": f"points must be between 1 and {len(TARGETS)}"}), 400
+
+        if mode == "finite_difference":
+            base, sens = feature_sensitivity_finite_difference(
+                years, quarters, rainfall, temperature,
+                delta_year=int(data.get("delta_year", 1)),
+                delta_quarter=int(data.get("delta_quarter", 1)),
+                delta_rain=float(data.get("delta_rain", 0.05)),
+                delta_temp=float(data.get("delta_temp", 1.0)),
+            )
+        elif mode == "jacobian":
+            base, sens = feature_sensitivity_jacobian(years, quarters, rainfall, temperature)
+        else:
+            return jsonify({"error": "mode must be 'finite_difference' or 'jacobian'"}), 400
+
+        cols = [p - 1 for p in points]
+        base, sens = base[:, cols], sens[:, cols, :]
+
+        response = {
+            "mode"       : mode,
+            "features"   : SENSITIVITY_FEATURES,
+            "points"     : [TARGETS[c] for c in cols],
+            "years"      : years.tolist(),
+            "quarters"   : quarters.tolist(),
+            "base"       : base.tolist(),        # (quarters, points)
+            "sensitivity": sens.tolist(),        # (quarters, points, features)
+        }
+        if want_png:
+            if len(years) != 1:
+                return jsonify({"error": "png is only available for a single quarter"}), 400
+            response["heatmap_png_base64"] = render_sensitivity_png(
+                sens[0], points, f"Sensitivity at {years[0]}-Q{quarters[0]}")
+
+        return jsonify(response), 200
+
+    except (KeyError, ValueError, IndexError) as exc:
+        return jsonify({"error": str(exc)}), 400
+    except Exception as exc:
+        return jsonify({"error": str(exc), "trace": traceback.format_exc()}), 500
+    
+SIMULATION_MODES = ("model", "surrogate")
+SIMULATION_FEATURES = ['year', 'quarter', 'rainfall', 'temperature']
+SIMULATION_MAX_SCENARIOS = int(os.environ.get("SIMULATION_MAX_SCENARIOS", 1000))
+# quarters (model input rows) per request, summed over all scenarios
+SIMULATION_MAX_ROWS = int(os.environ.get("SIMULATION_MAX_ROWS", 100000))
+
+def parse_flag(value, name):
+    """Strict JSON boolean: true/false, 1/0 or the strings "true"/"false"/"1"/"0"."""
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, int) and value in (0, 1):
+        return bool(value)
+    if isinstance(value, str) and value.strip().lower() in ("true", "false", "1", "0"):
+        return value.strip().lower() in ("true", "1")
+    raise ValueError(f"'{name}' must be true or false")
+
+@app.get("/predict_simulation_tool/cache_stats")
+def simulation_cache_stats():
+    return jsonify(simulation_prediction_cache.stats())
+
 # New route for simulation tool prediction
 @app.route('/predict_simulation_tool', methods=['POST'])
 def predict():
@@ -159,34 +313,56 @@ def predict():
         date = input_data.get('date')
         rainfall = input_data.get('rainfall')
         temp = input_data.get('temp')
+        # "surrogate" interpolates the precomputed response surface; explanations
+        # are then skipped unless asked for, since SHAP dominates the latency
+        mode = input_data.get('mode', 'model')
+        if mode not in SIMULATION_MODES:
+            return jsonify({"message": f"mode must be one of {', '.join(SIMULATION_MODES)}"}), 400
+        explain = parse_flag(input_data.get('explain', mode == 'model'), 'explain')
+
+        simulation_model, scaler_features, scaler_targets = get_model("simulation")
 
         # Prepare input features
-        future_X = prepare_future_input_simulation(date, rainfall, temp)
+        future_X = prepare_future_input_simulation(date, rainfall, temp, max_rows=SIMULATION_MAX_ROWS)
 
         # Make predictions
-        predictions_df = make_prediction_simulation(simulation_model, future_X, scaler_features, scaler_targets)
-
-        # Calculate SHAP feature importance
-        feature_names = ['year', 'quarter', 'rainfall', 'temperature']
-        target_names = ['c1_dist', 'c2_dist', 'c3_dist', 'c4_dist', 'c7_dist', 'c8_dist']
-        feature_importance = calculate_shap_feature_importance(simulation_model, future_X, feature_names)
+        predictions_df = None
+        if mode == 'surrogate':
+            predictions_df = make_prediction_simulation_surrogate(future_X, scaler_features)
+            if predictions_df is None:
+                # no current surrogate, or inputs outside its grid
+                mode = 'model'
+                future_X = prepare_future_input_simulation(date, rainfall, temp, max_rows=SIMULATION_MAX_ROWS)
+        if predictions_df is None:
+            predictions_df = make_prediction_simulation_cached(simulation_model, future_X, scaler_features, scaler_targets)
+
+        response = {"predictions": predictions_df.to_dict(orient='records'), "mode": mode}
+        if not explain:
+            return jsonify(response), 200
+
+        # One SHAP pass per target with the cached explainers; the overall
+        # importance is the first target's row of the same result
+        feature_names = SIMULATION_FEATURES
+        target_names = simulation_target_names(scaler_targets)
+        mean_abs_shap_values = shap_mean_abs_per_target(simulation_model, future_X, feature_names)
+        feature_importance = calculate_shap_feature_importance(
+            simulation_model, future_X, feature_names, mean_abs_shap_values=mean_abs_shap_values[0])
 
         # Calculate SHAP feature importance per target and generate heatmap URL
         feature_importance_per_target, heatmap_url = calculate_shap_feature_importance_per_target(
             model=simulation_model,
             data=future_X,
             feature_names=feature_names,
-            target_names=target_names
+            target_names=target_names,
+            mean_abs_shap_values=mean_abs_shap_values
         )
 
         # Prepare response
-        response = {
-            "predictions": predictions_df.to_dict(orient='records'),
+        response.update({
             "feature_importance": feature_importance,
             "feature_importance_per_target": feature_importance_per_target,
             "heatmap_url": heatmap_url,  # Return the base64-encoded image URL
-            "centerline_coordinates": predictions_df['centerline_coordinates'].iloc[0]  # Add centerline coordinates
-        }
+        })
         return jsonify(response), 200
 
     except HTTPException:
@@ -197,54 +373,71 @@ def predict():
         return jsonify({"message": f"{e} - Request body input is invalid"}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
-    
-# New route for simulation tool prediction
-@app.route('/predict_simulation_tool', methods=['POST'])
-def predict():
-    try:
-        # Parse input data
-        input_data = request.get_json()
-        date = input_data.get('date')
-        rainfall = input_data.get('rainfall')
-        temp = input_data.get('temp')
 
-        print('date: ', date, 'rainfall: ', rainfall, 'temp: ', temp)
-
-        # Prepare input features
-        future_X = prepare_future_input_simulation(date, rainfall, temp)
 
-        # Make predictions
-        predictions_df = make_prediction_simulation(simulation_model, future_X, scaler_features, scaler_targets)
-
-        # Calculate SHAP feature importance
-        feature_names = ['year', 'quarter', 'rainfall', 'temperature']
-        target_names = ['c1_dist','c2_dist','c3_dist','c4_dist','c5_dist','c6_dist','c7_dist','c8_dist'] 
-        feature_importance = calculate_shap_feature_importance(simulation_model, future_X, feature_names)
-
-        feature_importance_per_target = calculate_shap_feature_importance_per_target(
-            model=simulation_model,
-            data=future_X,
-            feature_names=feature_names,
-            target_names=target_names
-        )
-
-        # Prepare response
-        response = {
-            "predictions": predictions_df.to_dict(orient='records'),
-            "feature_importance": feature_importance,
-            "feature_importance_per_target": feature_importance_per_target
-
-        }
-        return jsonify(response), 200
+# Many (date, rainfall, temp) scenarios in one request: one input frame,
+# one model.predict for the rows not cached yet, results grouped by scenario
+@app.route('/predict_simulation_tool/batch', methods=['POST'])
+def predict_batch():
+    # {"scenarios": [{"date", "rainfall", "temp"}, …], "explain": false, "mode": "model" | "surrogate"}
+    try:
+        input_data = request.get_json()
+        scenarios = input_data['scenarios']
+        if not isinstance(scenarios, list) or not scenarios:
+            return jsonify({"message": "scenarios must be a non-empty list"}), 400
+        if len(scenarios) > SIMULATION_MAX_SCENARIOS:
+            return jsonify({"message": f"at most {SIMULATION_MAX_SCENARIOS} scenarios per request"}), 400
+        mode = input_data.get('mode', 'model')
+        if mode not in SIMULATION_MODES:
+            return jsonify({"message": f"mode must be one of {', '.join(SIMULATION_MODES)}"}), 400
+        explain = parse_flag(input_data.get('explain', False), 'explain')
+
+        dates = [scenario['date'] for scenario in scenarios]
+        rainfall = [float(scenario['rainfall']) for scenario in scenarios]
+        temp = [float(scenario['temp']) for scenario in scenarios]
+
+        simulation_model, scaler_features, scaler_targets = get_model("simulation")
+        future_X, counts = prepare_future_input_simulation_batch(dates, rainfall, temp,
+                                                                 max_rows=SIMULATION_MAX_ROWS)
+
+        predictions_df = None
+        if mode == 'surrogate':
+            predictions_df = make_prediction_simulation_surrogate(future_X, scaler_features)
+            if predictions_df is None:
+                mode = 'model'
+                future_X, counts = prepare_future_input_simulation_batch(dates, rainfall, temp,
+                                                                         max_rows=SIMULATION_MAX_ROWS)
+        if predictions_df is None:
+            predictions_df = make_prediction_simulation_cached(simulation_model, future_X, scaler_features, scaler_targets)
+
+        records = predictions_df.to_dict(orient='records')
+        ends = np.cumsum(counts)
+        # one SHAP pass over every row; each scenario averages its own rows
+        abs_shap_values = (shap_abs_per_target(simulation_model, future_X, SIMULATION_FEATURES)
+                           if explain and len(future_X) else None)
+
+        target_names = simulation_target_names(scaler_targets)
+        results = []
+        for k, (start, end) in enumerate(zip(ends - counts, ends)):
+            result = {"date": dates[k], "rainfall": rainfall[k], "temp": temp[k], "predictions": records[start:end]}
+            if abs_shap_values is not None and end > start:
+                mean_abs_shap_values = abs_shap_values[:, start:end].mean(axis=1)
+                result["feature_importance"] = calculate_shap_feature_importance(
+                    simulation_model, None, SIMULATION_FEATURES, mean_abs_shap_values=mean_abs_shap_values[0])
+                result["feature_importance_per_target"] = feature_importance_per_target_dict(
+                    SIMULATION_FEATURES, target_names, mean_abs_shap_values)
+            results.append(result)
+
+        return jsonify({"mode": mode, "scenarios": results}), 200
 
     except HTTPException:
         return jsonify({"message": "Unsupported Media Type: Send request as encoded JSON"}), 415
     except KeyError as e:
         return jsonify({"message": f"{e} - Key not found in request body"}), 404
-    except ValueError as e:
+    except (ValueError, TypeError) as e:
         return jsonify({"message": f"{e} - Request body input is invalid"}), 400
     except Exception as e:
-        return jsonify({'error': str(e)}), 500  
+        return jsonify({'error': str(e)}), 500
 
 
 # ------------------------------------------------------------------
@@ -269,25 +462,25 @@ def get_erosion_history():
         ):
             return jsonify({"error": "start date must be ≤ end date"}), 400
 
-        history_data = []
-        y, q = start_year, start_quarter
-        while (y < end_year) or (y == end_year and q <= end_quarter):
-            X = prepare_future_input(y, q, rainfall, temperature)
-            preds = make_predictions(X)          # {"Point_1": …, …}
-
-            for pt, val in preds.items():
-                history_data.append({
-                    "point": pt,
-                    "year":  y,
-                    "quarter": q,
-                    "value": round(val * 0.625, 3)   # scale + nice rounding
-                })
-
-            # step to next quarter
-            q += 1
-            if q > 4:
-                q = 1
-                y += 1
+        # featurize the whole span, then a single batched forward pass
+        years, quarters = quarter_span(start_year, start_quarter, end_year, end_quarter)
+        X = prepare_future_input_batch(years, quarters, rainfall, temperature)
+        values = np.round(make_predictions_batch(X) * 0.625, 3)   # (quarters, 25), scale + nice rounding
+
+        if d.get("format") == "columnar":
+            return jsonify({"history": {
+                "points"  : TARGETS,
+                "years"   : years.tolist(),
+                "quarters": quarters.tolist(),
+                "values"  : values.tolist()
+            }}), 200
+
+        years, quarters, rows = years.tolist(), quarters.tolist(), values.tolist()
+        history_data = [
+            {"point": pt, "year": y, "quarter": q, "value": val}
+            for y, q, row in zip(years, quarters, rows)
+            for pt, val in zip(TARGETS, row)
+        ]
 
         return jsonify({"history": history_data}), 200
 
@@ -299,8 +492,13 @@ def get_prediction():
     date = request.args.get("date")
     if not date:
         return jsonify({"error": "Missing date parameter"}), 400
+    explain = request.args.get("explain", "exact")
+    if explain not in EXPLAIN_MODES:
+        return jsonify({"error": f"explain must be one of {', '.join(EXPLAIN_MODES)}"}), 400
 
-    result = flood_prediction_logic(date, prophet_model, prophet_train, temp_model, hum_model, rain_model)
+    prophet_model, prophet_train, temp_model, hum_model, rain_model = get_model("flood_prophet")
+    result = flood_prediction_logic(date, prophet_model, prophet_train, temp_model, hum_model, rain_model,
+                                    forecast_table=get_forecast_table(), explain=explain)
 
     if "error" in result:
         return jsonify(result), 400 if "format" in result["error"] else 404
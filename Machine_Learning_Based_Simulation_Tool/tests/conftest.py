@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the app imports its modules as utils.*, relative to Machine_Learning_Based_Simulation_Tool/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,72 @@
+import os
+
+import numpy as np
+import pytest
+import tensorflow as tf
+
+import utils.riverbank_erosion as riverbank_erosion
+from utils.dense_inference import build_predictor, export_dense_weights
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODEL_FILE = os.path.join(APP_DIR, "model", "riverwidth_nn.h5")
+BUNDLE_FILE = os.path.join(APP_DIR, "data_dir", "preprocessors.pkl")
+BACKENDS = ["numpy", "tf_function"]
+
+
+def raw_inputs(n=256, seed=0):
+    """Forecast-range inputs in the units the API receives them in."""
+    rng = np.random.default_rng(seed)
+    return (rng.integers(2025, 2101, n), rng.integers(1, 5, n),
+            np.clip(rng.normal(0.39, 0.22, n), 0, None), rng.uniform(298.0, 303.0, n))
+
+
+def assert_matches_predict(model, X, backend, capsys):
+    predict_fn = build_predictor(model, backend)
+    assert "Falling back" not in capsys.readouterr().out
+    expected = np.asarray(model.predict(X, verbose=0))
+    np.testing.assert_allclose(predict_fn(X), expected, rtol=1e-5, atol=1e-4 * np.abs(expected).max())
+
+
+@pytest.fixture(scope="module")
+def riverwidth():
+    if not (os.path.exists(MODEL_FILE) and os.path.exists(BUNDLE_FILE)):
+        pytest.skip("riverwidth model artifacts are not available")
+    with pytest.MonkeyPatch.context() as mp:
+        # the module's own paths are Windows-style, relative to the app directory
+        mp.setattr(riverbank_erosion, "BUNDLE_PATH", BUNDLE_FILE)
+        preprocessors = riverbank_erosion._load_preprocessors()
+    return tf.keras.models.load_model(MODEL_FILE, compile=False), preprocessors
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_riverwidth_backends_match_predict(riverwidth, backend, monkeypatch, capsys):
+    model, preprocessors = riverwidth
+    monkeypatch.setattr(riverbank_erosion, "get_model", lambda name: preprocessors)
+    X = riverbank_erosion.prepare_future_input_batch(*raw_inputs())
+    assert_matches_predict(model, X, backend, capsys)
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_backends_match_predict_on_unscaled_features(backend, capsys):
+    """Raw year / temperature columns (~2025, ~300) push activations far outside the N(0, 1) probe."""
+    tf.keras.utils.set_random_seed(0)
+    model = tf.keras.Sequential([
+        tf.keras.Input(shape=(4,)),
+        tf.keras.layers.Dense(32, activation="relu"),
+        tf.keras.layers.BatchNormalization(),
+        tf.keras.layers.Dropout(0.2),
+        tf.keras.layers.Dense(16),
+        tf.keras.layers.Activation("tanh"),
+        tf.keras.layers.Dense(25),
+    ])
+    bn = model.layers[1]
+    bn.set_weights([w + np.random.default_rng(1).uniform(0.5, 1.5, w.shape) for w in bn.get_weights()])
+    X = np.column_stack(raw_inputs()).astype(np.float32)
+    assert_matches_predict(model, X, backend, capsys)
+
+
+def test_unsupported_layer_is_rejected():
+    model = tf.keras.Sequential([tf.keras.Input(shape=(4, 1)), tf.keras.layers.Conv1D(2, 2),
+                                 tf.keras.layers.Flatten(), tf.keras.layers.Dense(1)])
+    with pytest.raises(ValueError):
+        export_dense_weights(model)
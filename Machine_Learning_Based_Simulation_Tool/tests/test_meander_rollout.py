@@ -0,0 +1,87 @@
+import numpy as np
+import pandas as pd
+import pytest
+import tensorflow as tf
+from sklearn.decomposition import PCA
+from sklearn.preprocessing import StandardScaler
+
+from utils.meander_migration import (add_time_features, pca_projection, predict_meandering, project,
+                                     time_for_steps)
+from utils.meander_migration_xai import predict_step
+
+N_TARGETS = 9        # distances + bends predicted per quarter
+N_PCA = 3            # + 3 time features = the model's 6 input columns
+
+
+class StubModel:
+    """Deterministic (1, 4, 6) -> (1, N_TARGETS) map standing in for the meander LSTM."""
+
+    def __init__(self, seed=0):
+        rng = np.random.default_rng(seed)
+        self.weights = tf.constant(rng.normal(scale=0.3, size=(4 * (N_PCA + 3), N_TARGETS)), dtype=tf.float32)
+
+    def __call__(self, x):
+        x = tf.reshape(tf.convert_to_tensor(x, dtype=tf.float32), [tf.shape(x)[0], -1])
+        return tf.tanh(x @ self.weights)
+
+
+def reference_rollout(model, last_known_input, n_steps, pca, time_features):
+    """The original step loop: pca.transform over the list of predictions made so far."""
+    predictions = []
+    for _ in range(n_steps):
+        if _ == 0:
+            window = last_known_input
+        elif _ < 4:
+            concatenated = np.concatenate([pca.transform(np.array(predictions)), time_features[:_]], axis=1)
+            window = np.vstack([last_known_input[_:], concatenated])
+        else:
+            window = np.concatenate([pca.transform(np.array(predictions[-4:])), time_features[(_ - 3):_ + 1, :]],
+                                    axis=1)
+        pred = predict_step(np.expand_dims(np.asarray(window, dtype=np.float32), axis=0), model)
+        predictions.append(np.asarray(tf.reshape(pred, [-1])))
+    return np.array(predictions)
+
+
+def make_inputs(n_steps, whiten, seed=0):
+    rng = np.random.default_rng(seed)
+    pca = PCA(n_components=N_PCA, whiten=whiten).fit(rng.normal(size=(200, N_TARGETS)))
+    scaler_year = StandardScaler().fit(pd.DataFrame({'year': np.arange(1990, 2025)}))
+    last_known_input = rng.normal(size=(4, N_PCA + 3)).astype(np.float32)
+    years, quarters = time_for_steps(n_steps)
+    time_df = add_time_features(pd.DataFrame({'year': years, 'quarter': quarters}), scaler_year)
+    time_features = time_df[['quarter_sin', 'quarter_cos', 'year_scaled']].values
+    return pca, scaler_year, last_known_input, years, quarters, time_features
+
+
+@pytest.mark.parametrize("whiten", [False, True])
+def test_projection_matches_pca_transform(whiten):
+    pca = make_inputs(1, whiten)[0]
+    x = np.random.default_rng(1).normal(size=(16, N_TARGETS))
+    np.testing.assert_allclose(project(pca_projection(pca), x), pca.transform(x), rtol=1e-10, atol=1e-10)
+
+
+@pytest.mark.parametrize("whiten", [False, True])
+def test_ring_buffer_rollout_matches_reference(whiten):
+    n_steps = 12
+    model = StubModel()
+    pca, scaler_year, last_known_input, years, quarters, time_features = make_inputs(n_steps, whiten)
+
+    fast, windows, pca_feats = predict_meandering(model, last_known_input, n_steps, pca, years, quarters, scaler_year)
+    reference = reference_rollout(model, last_known_input, n_steps, pca, time_features)
+
+    assert fast.shape == (n_steps, N_TARGETS)
+    assert len(windows) == len(pca_feats) == n_steps
+    np.testing.assert_allclose(fast, reference, atol=1e-5)
+
+
+def test_continued_rollout_matches_single_rollout():
+    n_steps = 10
+    model = StubModel()
+    pca, scaler_year, last_known_input, years, quarters, _ = make_inputs(n_steps, whiten=False)
+
+    full, _, _ = predict_meandering(model, last_known_input, n_steps, pca, years, quarters, scaler_year)
+    first, windows, pca_feats = predict_meandering(model, last_known_input, 6, pca, years[:6], quarters[:6],
+                                                   scaler_year)
+    continued, _, _ = predict_meandering(model, last_known_input, n_steps, pca, years, quarters, scaler_year,
+                                         predictions=list(first), windows=windows, pca_feats=pca_feats)
+    np.testing.assert_allclose(continued, full, atol=1e-6)
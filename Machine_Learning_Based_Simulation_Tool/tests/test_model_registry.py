@@ -0,0 +1,17 @@
+import sys
+
+import pytest
+
+from utils import model_registry
+from utils.model_registry import get_model, model_stats, register_model
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="/proc fallback is Linux-only")
+def test_resident_memory_is_reported_without_psutil(monkeypatch):
+    monkeypatch.setattr(model_registry, "psutil", None)
+    register_model("test_rss_block", lambda: bytearray(64 << 20))
+    get_model("test_rss_block")
+
+    stats = model_stats()
+    assert stats["process_rss_bytes"] > 0
+    assert stats["models"]["test_rss_block"]["rss_delta_bytes"] >= 32 << 20
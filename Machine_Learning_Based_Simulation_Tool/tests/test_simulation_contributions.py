@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.multioutput import MultiOutputRegressor
+
+xgboost = pytest.importorskip("xgboost")
+
+import utils.simulation_tool_xai as simulation_tool_xai
+from utils.simulation_tool_xai import shap_abs_per_target, shap_mean_abs_per_target
+
+FEATURES = ['year', 'quarter', 'rainfall', 'temperature']
+N_TARGETS = 3
+
+
+@pytest.fixture(scope="module")
+def fitted():
+    rng = np.random.default_rng(0)
+    n = 400
+    data = pd.DataFrame({'year': rng.integers(2000, 2025, n), 'quarter': rng.integers(1, 5, n),
+                         'rainfall': rng.normal(size=n), 'temperature': rng.normal(size=n)}).astype(float)
+    targets = np.column_stack([
+        0.1 * (data['year'] - 2000) + data['rainfall'] ** 2,
+        np.sin(data['quarter']) * data['temperature'],
+        data['rainfall'] - 0.5 * data['temperature'] + rng.normal(scale=0.1, size=n),
+    ])
+    model = MultiOutputRegressor(xgboost.XGBRegressor(n_estimators=30, max_depth=4, random_state=0))
+    model.fit(data[FEATURES], targets)
+    return model, data.iloc[:64]
+
+
+def test_native_contributions_match_shap(fitted, capsys):
+    model, data = fitted
+    native = shap_abs_per_target(model, data, FEATURES, backend="native")
+    assert "Falling back" not in capsys.readouterr().out
+    reference = shap_abs_per_target(model, data, FEATURES, backend="shap")
+
+    assert native.shape == reference.shape == (N_TARGETS, len(data), len(FEATURES))
+    np.testing.assert_allclose(native, reference, rtol=1e-4, atol=1e-5)
+
+
+def test_mean_abs_per_target_matches_shap(fitted):
+    model, data = fitted
+    np.testing.assert_allclose(shap_mean_abs_per_target(model, data, FEATURES, backend="native"),
+                               shap_mean_abs_per_target(model, data, FEATURES, backend="shap"),
+                               rtol=1e-4, atol=1e-5)
+
+
+def test_unknown_backend_is_rejected(fitted):
+    model, data = fitted
+    with pytest.raises(ValueError):
+        shap_abs_per_target(model, data, FEATURES, backend="lime")
+
+
+def test_native_backend_leaves_model_boosters_untouched(fitted, monkeypatch):
+    model, data = fitted
+    monkeypatch.setattr(simulation_tool_xai, "SIMULATION_EXPLAIN_NTHREAD", 3)
+    simulation_tool_xai.contrib_boosters.cache_clear()
+    configs = [estimator.get_booster().save_config() for estimator in model.estimators_]
+    shap_abs_per_target(model, data, FEATURES, backend="native")
+    assert [estimator.get_booster().save_config() for estimator in model.estimators_] == configs
@@ -0,0 +1,28 @@
+import numpy as np
+import pytest
+
+from utils.simulation_tool import prepare_future_input_simulation_batch
+
+
+def test_rows_per_scenario_start_at_2025_q1():
+    data_df, counts = prepare_future_input_simulation_batch(['2025-02-10', '2026-07-01'], [0.3, 0.4], [300.0, 301.0])
+    assert counts.tolist() == [1, 7]
+    assert data_df['year'].tolist()[1:] == [2025] * 4 + [2026] * 3
+    assert data_df['quarter'].tolist()[1:] == [1, 2, 3, 4, 1, 2, 3]
+
+
+@pytest.mark.parametrize("bad_date", [None, "", "not a date", "2025-13-01"])
+def test_unparsable_date_names_the_scenario(bad_date):
+    with pytest.raises(ValueError, match="scenario 1"):
+        prepare_future_input_simulation_batch(['2025-06-01', bad_date], [0.3, 0.3], [300.0, 300.0])
+
+
+def test_date_before_first_forecast_quarter_is_rejected():
+    with pytest.raises(ValueError, match="scenario 2: .* before 2025-Q1"):
+        prepare_future_input_simulation_batch(['2025-06-01', '2025-01-01', '2024-12-31'],
+                                              [0.3] * 3, [300.0] * 3)
+
+
+def test_row_cap_is_checked_before_building():
+    with pytest.raises(ValueError, match="limit is 10"):
+        prepare_future_input_simulation_batch(['2030-01-01'] * 2, [0.3] * 2, [300.0] * 2, max_rows=10)
@@ -0,0 +1,46 @@
+import os
+import pickle
+
+import joblib
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.linear_model import LinearRegression
+from sklearn.multioutput import MultiOutputRegressor
+from sklearn.preprocessing import StandardScaler
+
+from utils.simulation_tool import SIMULATION_TARGETS, simulation_target_names
+from utils.simulation_tool_xai import feature_importance_per_target_dict
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODEL_FILE = os.path.join(APP_DIR, "model", "riverinsight_simulation_ML_model.pkl")
+SCALER_TARGETS_FILE = os.path.join(APP_DIR, "data_dir", "scaler_targets_simulation.pkl")
+FEATURES = ['year', 'quarter', 'rainfall', 'temperature']
+
+
+def test_target_names_match_the_shipped_model():
+    if not (os.path.exists(MODEL_FILE) and os.path.exists(SCALER_TARGETS_FILE)):
+        pytest.skip("simulation model artifacts are not available")
+    with open(MODEL_FILE, 'rb') as f:
+        model = pickle.load(f)
+    names = simulation_target_names(joblib.load(SCALER_TARGETS_FILE))
+
+    assert len(names) == len(model.estimators_)
+    assert names == SIMULATION_TARGETS
+
+
+def test_per_target_importance_has_one_label_per_estimator():
+    rng = np.random.default_rng(0)
+    X = pd.DataFrame(rng.normal(size=(50, len(FEATURES))), columns=FEATURES)
+    y = pd.DataFrame(rng.normal(size=(50, len(SIMULATION_TARGETS))), columns=SIMULATION_TARGETS)
+    model = MultiOutputRegressor(LinearRegression()).fit(X, y)
+    names = simulation_target_names(StandardScaler().fit(y))
+
+    importance = feature_importance_per_target_dict(FEATURES, names, rng.uniform(size=(len(model.estimators_), 4)))
+    assert list(importance) == SIMULATION_TARGETS
+    assert len(importance) == len(model.estimators_)
+
+
+def test_unnamed_scaler_falls_back_to_all_targets():
+    scaler = StandardScaler().fit(np.zeros((3, len(SIMULATION_TARGETS))))
+    assert simulation_target_names(scaler) == SIMULATION_TARGETS
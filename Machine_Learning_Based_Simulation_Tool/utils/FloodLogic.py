@@ -1,15 +1,33 @@
 import os
 import pickle
+import threading
+from functools import lru_cache
 import pandas as pd
 import numpy as np
 from prophet import Prophet
-from sklearn.metrics import mean_absolute_error
-from itertools import product
-from sklearn.model_selection import TimeSeriesSplit
+from prophet.utilities import regressor_coefficients
+from utils.model_registry import register_model, get_model, model_version
+from utils.prophet_cache import load_or_fit_helper_models
+from utils.prophet_search import search_prophet_params
 
 MODEL_FILE = os.path.join("model", "prophet_model.pkl")
 TRAIN_FILE = os.path.join("model", "prophet_train.csv")
 TRAIN_FILE_M = os.path.join("model", "master2.csv")
+SEARCH_CHECKPOINT_FILE = os.path.join("model", "prophet_search_scores.jsonl")
+
+# days past the last training date held in the materialised forecast table
+FORECAST_HORIZON_DAYS = 5 * 365
+
+REGRESSORS_TO_SIMULATE = ["Average_Temperature", "Rainfall", "Average_Humidity", "Max_Humidity", "Max_Temperature"]
+
+# explanation backends for /predict/flooding
+EXPLAIN_MODES = ("exact", "lime", "none")
+# calendar encodings are left out of the reported contributors (as in the LIME output)
+EXPLAIN_EXCLUDED = ["month_sin", "month_cos", "day_sin", "day_cos"]
+
+# grid-search settings: worker processes (1 = sequential) and optional early-pruning factor
+SEARCH_N_JOBS = int(os.environ.get("PROPHET_SEARCH_JOBS", os.cpu_count() or 1))
+SEARCH_PRUNE_FACTOR = float(os.environ["PROPHET_SEARCH_PRUNE"]) if os.environ.get("PROPHET_SEARCH_PRUNE") else None
 
 temperature_model = None
 humidity_model = None
@@ -69,33 +87,15 @@ def load_model():
             if reg in train_data.columns:
                 prophet_train[reg] = train_data[reg]
 
-        tscv = TimeSeriesSplit(n_splits=2)
         param_grid = {
             "changepoint_prior_scale": [0.01, 0.1, 0.5, 1.0],
             "seasonality_prior_scale": [0.1, 1.0, 5.0, 10.0]
         }
-        best_params = None
-        best_score = float("inf")
-        for cps, sps in product(param_grid["changepoint_prior_scale"], param_grid["seasonality_prior_scale"]):
-            cv_scores = []
-            for train_idx, val_idx in tscv.split(prophet_train):
-                train_cv, val_cv = prophet_train.iloc[train_idx], prophet_train.iloc[val_idx]
-                model_cv = Prophet(
-                    changepoint_prior_scale=cps,
-                    seasonality_prior_scale=sps,
-                    daily_seasonality=True
-                )
-                for reg in additional_regressors:
-                    if reg in prophet_train.columns:
-                        model_cv.add_regressor(reg)
-                model_cv.fit(train_cv)
-                forecast_cv = model_cv.predict(val_cv)
-                mae = mean_absolute_error(val_cv["y"], forecast_cv["yhat"])
-                cv_scores.append(mae)
-            avg_cv_score = np.mean(cv_scores)
-            if avg_cv_score < best_score:
-                best_score = avg_cv_score
-                best_params = (cps, sps)
+        best_params, best_score = search_prophet_params(
+            prophet_train, additional_regressors, param_grid, n_splits=2,
+            n_jobs=SEARCH_N_JOBS, checkpoint_file=SEARCH_CHECKPOINT_FILE,
+            prune_factor=SEARCH_PRUNE_FACTOR
+        )
 
         model = Prophet(
             changepoint_prior_scale=best_params[0],
@@ -110,31 +110,19 @@ def load_model():
             pickle.dump(model, fout)
         prophet_train.to_csv(TRAIN_FILE, index=False)
 
-    # Train helper models
-    if "Average_Temperature" in prophet_train.columns:
-        temp_df = prophet_train[["ds", "Average_Temperature"]].dropna().rename(columns={"Average_Temperature": "y"})
-        temperature_model = Prophet(daily_seasonality=True).fit(temp_df)
-    if "Average_Humidity" in prophet_train.columns:
-        hum_df = prophet_train[["ds", "Average_Humidity"]].dropna().rename(columns={"Average_Humidity": "y"})
-        humidity_model = Prophet(daily_seasonality=True).fit(hum_df)
-    if "Rainfall" in prophet_train.columns:
-        rain_df = prophet_train[["ds", "Rainfall"]].dropna().rename(columns={"Rainfall": "y"})
-        rainfall_model = Prophet(daily_seasonality=True).fit(rain_df)
+    # Helper models: reloaded from the artifact cache, refit only when prophet_train.csv changes
+    helpers = load_or_fit_helper_models(prophet_train, TRAIN_FILE, os.path.dirname(MODEL_FILE))
+    temperature_model = helpers["temperature"]
+    humidity_model = helpers["humidity"]
+    rainfall_model = helpers["rainfall"]
 
     return model, prophet_train, temperature_model, humidity_model, rainfall_model
 
-def flood_prediction_logic(date, model, prophet_train, temperature_model, humidity_model, rainfall_model):
-    try:
-        user_input_date = pd.to_datetime(date)
-    except Exception:
-        return {"error": "Invalid date format. Use YYYY-MM-DD"}
-
-    last_date = prophet_train["ds"].max()
-    if user_input_date <= last_date:
-        return {"error": f"Input date must be after {last_date.date()}"}
+register_model("flood_prophet", load_model, paths=[MODEL_FILE, TRAIN_FILE])
 
-    forecast_days = (user_input_date - last_date).days
-    future = model.make_future_dataframe(periods=forecast_days, freq="D")
+def build_future_frame(model, prophet_train, periods):
+    """History plus ``periods`` future days, with the simulated regressor columns filled in."""
+    future = model.make_future_dataframe(periods=periods, freq="D")
     future["month"] = future["ds"].dt.month
     future["day_of_year"] = future["ds"].dt.dayofyear
     future["month_sin"] = np.sin(2 * np.pi * future["month"] / 12)
@@ -142,8 +130,7 @@ def flood_prediction_logic(date, model, prophet_train, temperature_model, humidi
     future["day_sin"] = np.sin(2 * np.pi * future["day_of_year"] / 365)
     future["day_cos"] = np.cos(2 * np.pi * future["day_of_year"] / 365)
 
-    regressors_to_simulate = ["Average_Temperature", "Rainfall", "Average_Humidity", "Max_Humidity", "Max_Temperature"]
-    for reg in regressors_to_simulate:
+    for reg in REGRESSORS_TO_SIMULATE:
         if reg in prophet_train.columns:
             monthly_avg = prophet_train.groupby(prophet_train["ds"].dt.month)[reg].mean().to_dict()
             future[reg] = future["ds"].dt.month.map(monthly_avg)
@@ -155,39 +142,166 @@ def flood_prediction_logic(date, model, prophet_train, temperature_model, humidi
                 "cumulative_rainfall", "rainfall_ndwi_interaction", "extreme_rainfall",
                 "monthly_mean", "monthly_max"]:
         future[col] = prophet_train[col].iloc[-1]
+    return future
+
+
+# ────────────────────────────────────────────────────────────────────
+# Materialised forecast table: one model.predict over the whole horizon
+# per model version; requests become an array lookup plus a slice.
+# ────────────────────────────────────────────────────────────────────
+
+_forecast_table = None
+_forecast_table_lock = threading.Lock()
+_forecast_table_building = set()   # model versions with a build thread running
+
+
+def build_forecast_table(model, prophet_train, temperature_model, humidity_model, rainfall_model,
+                         horizon_days=FORECAST_HORIZON_DAYS, version=None):
+    future = build_future_frame(model, prophet_train, horizon_days)
+    forecast = model.predict(future)
 
-    future_forecast = model.predict(future)
-    forecast_for_date = future_forecast[future_forecast["ds"] == user_input_date]
-    if forecast_for_date.empty:
-        return {"error": "No forecast available for the specified date."}
+    ds = future["ds"].values.astype("datetime64[D]")
+    origin = ds[0]
+    offsets = (ds - origin).astype(np.int64)
+    # day offset -> row; history may have gaps, those days map to -1
+    day_index = np.full(int(offsets[-1]) + 1, -1, dtype=np.int64)
+    day_index[offsets] = np.arange(len(ds))
 
-    row = forecast_for_date.iloc[0]
-    water_area = row["yhat"]
+    regressor_names = [reg for reg in REGRESSORS_TO_SIMULATE if reg in future.columns]
+    helpers = {}
+    for name, helper in (("temperature", temperature_model), ("humidity", humidity_model), ("rainfall", rainfall_model)):
+        helpers[name] = np.ascontiguousarray(helper.predict(future[["ds"]])["yhat"].values) if helper else None
 
+    return {
+        "version": version,
+        "origin": origin,
+        "day_index": day_index,
+        "ds": ds,
+        "labels": future["ds"].dt.strftime("%b %d").values,
+        "yhat": np.ascontiguousarray(forecast["yhat"].values, dtype=np.float64),
+        "yhat_lower": np.ascontiguousarray(forecast["yhat_lower"].values, dtype=np.float64),
+        "yhat_upper": np.ascontiguousarray(forecast["yhat_upper"].values, dtype=np.float64),
+        "regressor_names": regressor_names,
+        "regressors": np.ascontiguousarray(future[regressor_names].to_numpy(dtype=np.float64)),
+        "helpers": helpers,
+        # kept for the LIME explainer, which needs the frames up to the requested row
+        "future": future,
+        "forecast": forecast,
+    }
+
+
+def _build_forecast_table_in_background(version):
+    global _forecast_table
+    try:
+        table = build_forecast_table(*get_model("flood_prophet"), version=version)
+        with _forecast_table_lock:
+            if version == model_version("flood_prophet"):
+                _forecast_table = table
+        print(f"Flood forecast table ready for model version {version}.")
+    except Exception as e:
+        print(f"Could not build flood forecast table: {e}")
+    finally:
+        with _forecast_table_lock:
+            _forecast_table_building.discard(version)
+
+
+def get_forecast_table():
+    """
+    Return the forecast table for the current flood model version, or None
+    while it is (re)built in a background thread.
+    """
+    version = model_version("flood_prophet")
+    table = _forecast_table
+    if table is not None and table["version"] == version:
+        return table
+    with _forecast_table_lock:
+        if version not in _forecast_table_building:
+            _forecast_table_building.add(version)
+            threading.Thread(target=_build_forecast_table_in_background, args=(version,), daemon=True).start()
+    return None
+
+
+def _table_row(table, date):
+    offset = int((np.datetime64(date.date(), "D") - table["origin"]).astype(np.int64))
+    if offset < 0 or offset >= len(table["day_index"]):
+        return None
+    row = table["day_index"][offset]
+    return None if row < 0 else int(row)
+
+
+def _risk_assessment(water_area):
     if water_area < 7.5:
-        risk_level = "Low Risk"
-        alerts = ["No flood warning", "Continue normal activities"]
+        return "Low Risk", ["No flood warning", "Continue normal activities"]
     elif water_area < 9.0:
-        risk_level = "Moderate Risk"
-        alerts = ["Flood risk moderate", "Be cautious", "Monitor water levels"]
-    else:
-        risk_level = "High Risk"
-        alerts = ["Flood warning issued", "Evacuate if necessary", "Seek higher ground"]
+        return "Moderate Risk", ["Flood risk moderate", "Be cautious", "Monitor water levels"]
+    return "High Risk", ["Flood warning issued", "Evacuate if necessary", "Seek higher ground"]
 
-    predicted_temperature = predicted_humidity = predicted_rainfall = None
-    if temperature_model:
-        predicted_temperature = float(round(temperature_model.predict(pd.DataFrame({"ds": [user_input_date]})).iloc[0]["yhat"], 2))
-    if humidity_model:
-        predicted_humidity = float(round(humidity_model.predict(pd.DataFrame({"ds": [user_input_date]})).iloc[0]["yhat"], 2))
-    if rainfall_model:
-        predicted_rainfall = float(round(rainfall_model.predict(pd.DataFrame({"ds": [user_input_date]})).iloc[0]["yhat"], 2))
+
+def flood_prediction_logic(date, model, prophet_train, temperature_model, humidity_model, rainfall_model,
+                           forecast_table=None, explain="exact"):
+    try:
+        user_input_date = pd.to_datetime(date)
+    except Exception:
+        return {"error": "Invalid date format. Use YYYY-MM-DD"}
+
+    last_date = prophet_train["ds"].max()
+    if user_input_date <= last_date:
+        return {"error": f"Input date must be after {last_date.date()}"}
 
     year_start = pd.Timestamp(year=user_input_date.year, month=1, day=1)
-    chart_df = future_forecast[(future_forecast["ds"] >= year_start) & (future_forecast["ds"] <= user_input_date)].copy()
-    chart_df["date"] = chart_df["ds"].dt.strftime("%b %d")
-    chart_data = chart_df[["date", "yhat"]].rename(columns={"yhat": "value"}).to_dict(orient="records")
+    row = _table_row(forecast_table, user_input_date) if forecast_table is not None else None
+
+    if row is not None:
+        # fast path: everything comes from the precomputed arrays
+        t = forecast_table
+        water_area = t["yhat"][row]
+        lower, upper = t["yhat_lower"][row], t["yhat_upper"][row]
+        helper_preds = {name: (None if values is None else float(round(values[row], 2)))
+                        for name, values in t["helpers"].items()}
+        regressor_values = {reg: float(round(t["regressors"][row, j], 2))
+                            for j, reg in enumerate(t["regressor_names"])}
+
+        chart_start = int(np.searchsorted(t["ds"], np.datetime64(year_start.date(), "D")))
+        chart_data = [{"date": label, "value": value}
+                      for label, value in zip(t["labels"][chart_start:row + 1], t["yhat"][chart_start:row + 1].tolist())]
+
+        future, future_forecast = t["future"].iloc[:row + 1], t["forecast"].iloc[:row + 1]
+    else:
+        # date outside the table (or table still building): forecast on demand
+        forecast_days = (user_input_date - last_date).days
+        future = build_future_frame(model, prophet_train, forecast_days)
+        future_forecast = model.predict(future)
+        forecast_for_date = future_forecast[future_forecast["ds"] == user_input_date]
+        if forecast_for_date.empty:
+            return {"error": "No forecast available for the specified date."}
+
+        forecast_row = forecast_for_date.iloc[0]
+        water_area = forecast_row["yhat"]
+        lower, upper = forecast_row["yhat_lower"], forecast_row["yhat_upper"]
+
+        helper_preds = {}
+        for name, helper in (("temperature", temperature_model), ("humidity", humidity_model), ("rainfall", rainfall_model)):
+            helper_preds[name] = float(round(helper.predict(pd.DataFrame({"ds": [user_input_date]})).iloc[0]["yhat"], 2)) if helper else None
+        regressor_values = {
+            reg: float(round(future[reg].iloc[-1], 2))
+            for reg in REGRESSORS_TO_SIMULATE if reg in future.columns
+        }
 
-    feature_importance = explain_prediction_with_lime(model, future, future_forecast, prophet_train, user_input_date)
+        chart_df = future_forecast[(future_forecast["ds"] >= year_start) & (future_forecast["ds"] <= user_input_date)].copy()
+        chart_df["date"] = chart_df["ds"].dt.strftime("%b %d")
+        chart_data = chart_df[["date", "yhat"]].rename(columns={"yhat": "value"}).to_dict(orient="records")
+
+    risk_level, alerts = _risk_assessment(water_area)
+    predicted_temperature = helper_preds["temperature"]
+    predicted_humidity = helper_preds["humidity"]
+    predicted_rainfall = helper_preds["rainfall"]
+
+    if explain == "lime":
+        feature_importance = explain_prediction_with_lime(model, future, future_forecast, prophet_train, user_input_date)
+    elif explain == "exact":
+        feature_importance = explain_prediction_exact(model, future, future_forecast, user_input_date)
+    else:
+        feature_importance = None
 
     return {
         "date": str(user_input_date.date()),
@@ -201,16 +315,50 @@ def flood_prediction_logic(date, model, prophet_train, temperature_model, humidi
         "current_water_area_km2": float(round(water_area, 2)),
         "rainfall_mm": predicted_rainfall or 0,
         "prediction_interval": {
-            "lower": float(round(row["yhat_lower"], 2)),
-            "upper": float(round(row["yhat_upper"], 2)),
-        },
-        "regressor_values": {
-            reg: float(round(future[reg].iloc[-1], 2))
-            for reg in regressors_to_simulate if reg in future.columns
+            "lower": float(round(lower, 2)),
+            "upper": float(round(upper, 2)),
         },
+        "regressor_values": regressor_values,
         "chart_data": chart_data,
-        "XAI_Feature_Importance": feature_importance
+        "XAI_Feature_Importance": feature_importance,
+        "XAI_Method": explain
+    }
+
+
+@lru_cache(maxsize=4)
+def _regressor_terms(model):
+    """Centers, coefficients and modes of the fitted extra regressors (in y units)."""
+    coefs = regressor_coefficients(model)
+    return (
+        list(coefs["regressor"]),
+        coefs["center"].to_numpy(dtype=np.float64),
+        coefs["coef"].to_numpy(dtype=np.float64),
+        (coefs["regressor_mode"] == "multiplicative").to_numpy(),
+    )
+
+
+def explain_prediction_exact(model, future_df, forecast_df, date_to_explain, top_k=3):
+    """
+    Exact per-regressor contributions to yhat on ``date_to_explain``.
+    Prophet adds each extra regressor as coef * (x - center) (times the trend for
+    multiplicative regressors), so no sampling is needed and the result is deterministic.
+    Returns the ``top_k`` contributors by absolute value, like the LIME explainer.
+    """
+    user_input_date = pd.to_datetime(date_to_explain)
+    idx = np.flatnonzero((future_df["ds"] == user_input_date).to_numpy())[0]
+
+    names, centers, coefs, multiplicative = _regressor_terms(model)
+    values = future_df[names].iloc[idx].to_numpy(dtype=np.float64)
+    contributions = (values - centers) * coefs
+    if multiplicative.any():
+        contributions[multiplicative] *= forecast_df["trend"].iloc[idx]
+
+    feature_contributions = {
+        name: float(contribution)
+        for name, contribution in zip(names, contributions)
+        if name not in EXPLAIN_EXCLUDED
     }
+    return dict(sorted(feature_contributions.items(), key=lambda x: abs(x[1]), reverse=True)[:top_k])
 
 
 from lime.lime_tabular import LimeTabularExplainer
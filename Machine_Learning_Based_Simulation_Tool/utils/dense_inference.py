@@ -0,0 +1,134 @@
+import numpy as np
+
+# ────────────────────────────────────────────────────────────────────
+# Lightweight inference for the small dense Keras models
+# (riverwidth_nn.h5, erosion_neural_network_model.h5).
+#   numpy       : weights exported once, forward pass as plain matmuls
+#   tf_function : model wrapped in a tf.function with a fixed signature
+# Both skip model.predict's per-call tf.data / callback overhead.
+# ────────────────────────────────────────────────────────────────────
+
+def _sigmoid(x):
+    return 1.0 / (1.0 + np.exp(-x))
+
+
+def _elu(x):
+    return np.where(x > 0, x, np.expm1(np.minimum(x, 0)))
+
+
+_ACTIVATIONS = {
+    "linear": lambda x: x,
+    "relu": lambda x: np.maximum(x, 0),
+    "tanh": np.tanh,
+    "sigmoid": _sigmoid,
+    "elu": _elu,
+    "selu": lambda x: 1.0507009873554805 * np.where(x > 0, x, 1.6732632423543772 * np.expm1(np.minimum(x, 0))),
+    "softplus": lambda x: np.logaddexp(x, 0),
+    "swish": lambda x: x * _sigmoid(x),
+    "silu": lambda x: x * _sigmoid(x),
+}
+
+# layers that are the identity at inference time
+_PASSTHROUGH_LAYERS = ("InputLayer", "Dropout", "AlphaDropout", "GaussianDropout", "GaussianNoise")
+
+
+def _activation_name(activation):
+    name = getattr(activation, "__name__", str(activation))
+    if name not in _ACTIVATIONS:
+        raise ValueError(f"Unsupported activation for NumPy inference: {name}")
+    return name
+
+
+def export_dense_weights(model):
+    """
+    Flatten a sequential stack of Dense / BatchNormalization / Activation layers
+    into a list of NumPy ops. Raises ValueError for anything else, in which
+    case the caller should stay on the Keras backend.
+    """
+    ops = []
+    for layer in model.layers:
+        kind = layer.__class__.__name__
+        if kind in _PASSTHROUGH_LAYERS:
+            continue
+        if kind == "Dense":
+            weights = layer.get_weights()
+            kernel = weights[0].astype(np.float32)
+            bias = weights[1].astype(np.float32) if layer.use_bias else np.zeros(kernel.shape[1], np.float32)
+            ops.append(("dense", kernel, bias, _activation_name(layer.activation)))
+        elif kind == "BatchNormalization":
+            weights = list(layer.get_weights())
+            gamma = weights.pop(0) if layer.scale else 1.0
+            beta = weights.pop(0) if layer.center else 0.0
+            moving_mean, moving_var = weights
+            scale = (gamma / np.sqrt(moving_var + layer.epsilon)).astype(np.float32)
+            shift = (beta - moving_mean * scale).astype(np.float32)
+            ops.append(("affine", scale, shift, "linear"))
+        elif kind == "Activation":
+            ops.append(("activation", None, None, _activation_name(layer.activation)))
+        else:
+            raise ValueError(f"Unsupported layer for NumPy inference: {kind}")
+    return ops
+
+
+def numpy_forward(ops, X):
+    """Run exported ops on X (N, n_features); returns float32 (N, n_outputs)."""
+    h = np.asarray(X, dtype=np.float32)
+    for kind, a, b, activation in ops:
+        if kind == "dense":
+            h = h @ a + b
+        elif kind == "affine":
+            h = h * a + b
+        h = _ACTIVATIONS[activation](h)
+    return h
+
+
+def make_tf_function(model, n_features):
+    """model.__call__ traced once for float32 (None, n_features) inputs."""
+    import tensorflow as tf
+
+    @tf.function(input_signature=[tf.TensorSpec(shape=[None, n_features], dtype=tf.float32)])
+    def forward(x):
+        return model(x, training=False)
+
+    return forward
+
+
+def check_backend_parity(model, predict_fn, n_features, n_rows=64, seed=0):
+    """Max absolute difference between predict_fn and model.predict on a random probe batch."""
+    probe = np.random.default_rng(seed).normal(size=(n_rows, n_features)).astype(np.float32)
+    expected = np.asarray(model.predict(probe, verbose=0))
+    return float(np.max(np.abs(np.asarray(predict_fn(probe)) - expected)))
+
+
+def build_predictor(model, backend, atol=1e-4):
+    """
+    Return predict_fn(X) -> np.ndarray for ``backend`` in {"keras", "numpy", "tf_function"}.
+    The numpy / tf_function backends are checked against model.predict once here;
+    on an unsupported architecture or a parity miss they fall back to Keras.
+    """
+    n_features = model.input_shape[-1]
+
+    def keras_predict(X):
+        return np.asarray(model.predict_on_batch(np.asarray(X, dtype=np.float32)))
+
+    if backend == "keras":
+        return keras_predict
+
+    try:
+        if backend == "numpy":
+            ops = export_dense_weights(model)
+            predict_fn = lambda X: numpy_forward(ops, X)
+        elif backend == "tf_function":
+            forward = make_tf_function(model, n_features)
+            predict_fn = lambda X: forward(np.asarray(X, dtype=np.float32)).numpy()
+        else:
+            raise ValueError(f"Unknown inference backend: {backend}")
+
+        max_diff = check_backend_parity(model, predict_fn, n_features)
+        if max_diff > atol:
+            raise ValueError(f"parity check failed (max |diff| = {max_diff:.2e})")
+        print(f"Using {backend} inference backend for {model.name} (max |diff| vs predict = {max_diff:.2e})")
+        return predict_fn
+    except ValueError as e:
+        print(f"Falling back to Keras inference for {model.name}: {e}")
+        return keras_predict
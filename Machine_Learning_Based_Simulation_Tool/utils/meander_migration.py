@@ -1,61 +1,46 @@
+import threading
 import pandas as pd
 import numpy as np
 import joblib
 import tensorflow as tf
 from sklearn.preprocessing import StandardScaler
-from utils.meander_migration_xai import intialize_model, generate_map
-from utils.com_cache import m_cache, data_cache
+from utils.meander_migration_xai import intialize_model, generate_maps_batch, predict_step
+from utils.shared_cache import shared_cache, versioned_key
+from utils.model_registry import register_model, get_model, model_version
 # to prevent the error when flattening the predictions
 import tensorflow.python.ops.numpy_ops.np_config as np_config
 np_config.enable_numpy_behavior()
 
-model=r'model\0_85_0_59_filt3_6feat.joblib'
-scaler_year=r'data_dir\scaler_year.pkl'
-scaler_ts=r'data_dir\scaler_ts.pkl'
-last_known_input=r'data_dir\last_known_input.pkl'
-pca=r'data_dir\pca_obj.pkl'
+model_path=r'model\0_85_0_59_filt3_6feat.joblib'
+scaler_year_path=r'data_dir\scaler_year.pkl'
+scaler_ts_path=r'data_dir\scaler_ts.pkl'
+last_known_input_path=r'data_dir\last_known_input.pkl'
+pca_path=r'data_dir\pca_obj.pkl'
 past_migration_vals=r'data_dir\MeanderingInterploatedUpdated.csv'
-latitudes=r'data_dir\y_coords_7.5m.npy'
-longitudes=r'data_dir\x_coords_7.5m.npy'
 
-model=joblib.load(model)
-scaler_year=joblib.load(scaler_year)
-scaler_ts=joblib.load(scaler_ts)
-last_known_input=joblib.load(last_known_input)
-pca=joblib.load(pca)
-past_vals=pd.read_csv(past_migration_vals, index_col=0)
-latitudes=np.load(latitudes)
-longitudes=np.load(longitudes)
+def _load_meander_model():
+  model=joblib.load(model_path)
+  model.training=False
+  return model
 
-inti_values=init_values = past_vals.iloc[0]
+register_model("meander_model", _load_meander_model, paths=[model_path])
+register_model("scaler_year", lambda: joblib.load(scaler_year_path), paths=[scaler_year_path])
+register_model("meander_scaler_ts", lambda: joblib.load(scaler_ts_path), paths=[scaler_ts_path])
+register_model("meander_last_known_input", lambda: joblib.load(last_known_input_path), paths=[last_known_input_path])
+register_model("meander_pca", lambda: joblib.load(pca_path), paths=[pca_path])
+# first observed centerline distances, the baseline every prediction is reported against
+register_model("meander_init_values", lambda: pd.read_csv(past_migration_vals, index_col=0).iloc[0])
 
-model.training=False
 
+def time_for_steps(n_steps):
+  """Years and quarters of the first n_steps forecast quarters, starting at 2025-Q1."""
+  steps=np.arange(n_steps)
+  return (2025+steps//4).tolist(), (steps%4+1).tolist()
 
 def get_new_time(year, quarter):
-  no_of_years=year-2024
-  no_of_q=((no_of_years-1)*4)+quarter
-
-  years=[]
-  quarters=[]
-
-  if no_of_years==1:
-    for i in range(no_of_q):
-      quarters.append(i+1)
-      years.append(2025)
-  else:
-     for i in range(no_of_years-1):
-      quarters.extend([1,2,3,4])
-      for j in range(4):
-        years.append(2024+i+1)
-
-      latest=years[-1]
-
-      for i in range(quarter):
-        quarters.append(i+1)
-        years.append(latest+1)
-
-  return years, quarters, len(quarters)
+  n_steps=(year-2025)*4+quarter
+  years, quarters=time_for_steps(n_steps)
+  return years, quarters, n_steps
 
 def add_time_features(df, scaler):
     # Cyclical encoding for quarter
@@ -67,75 +52,272 @@ def add_time_features(df, scaler):
     return df
 
 
-def predict_meandering(model, last_known_input, n_steps, pca, years, quarters, scaler_year ):
+def pca_projection(pca):
+  """(mean, components.T, whitening divisor) so a prediction is projected with one matmul."""
+  mean=np.asarray(pca.mean_, dtype=np.float64)
+  components_t=np.ascontiguousarray(np.asarray(pca.components_, dtype=np.float64).T)
+  divisor=np.sqrt(np.asarray(pca.explained_variance_, dtype=np.float64)) if getattr(pca, 'whiten', False) else None
+  return mean, components_t, divisor
+
+def project(projection, x):
+  mean, components_t, divisor=projection
+  feats=(np.asarray(x, dtype=np.float64)-mean) @ components_t
+  return feats if divisor is None else feats/divisor
+
+
+def predict_meandering(model, last_known_input, n_steps, pca, years, quarters, scaler_year,
+                       predictions=None, windows=None, pca_feats=None):
+    """
+    Autoregressive rollout up to n_steps (forward passes only). When the per-step
+    lists of an earlier (shorter) rollout are passed in, it continues from their
+    last step instead of starting again from 2025-Q1. Each step's input window is
+    returned so saliency can be computed later for the timesteps that are explained.
+
+    The last four (PCA features + time features) rows live in a ring buffer, and
+    each prediction is projected exactly once, when it is made.
+    """
     
     # from app import task_queue
 
-    predictions = []
-    maps=[]
-    current_input = last_known_input
+    predictions = list(predictions) if predictions is not None else []
+    windows = list(windows) if windows is not None else []
+    pca_feats = list(pca_feats) if pca_feats is not None else []
     time_df=pd.DataFrame({'year': years, 'quarter': quarters})
     time_df=add_time_features(time_df, scaler_year)
     time_features = time_df[['quarter_sin', 'quarter_cos', 'year_scaled']].values
+    projection=pca_projection(pca)
+    n_pca=projection[1].shape[1]
     
     model=intialize_model(model=model)
 
-    for _ in range(n_steps):
-
-        if _ ==0:
-          pred, sal_map=generate_map(np.expand_dims(current_input, axis=0), model)
-          maps.append(sal_map)
-          predictions.append(tf.reshape(pred, [-1]))
-          
-        elif _==1:
-          redundant_pred=predictions[-1]
-          pca_feat=pca.transform(redundant_pred.reshape(1, -1))
-          time=time_features[0]
-          time_reshaped = time.reshape(1, -1)  
-
-          concatenated = np.concatenate([pca_feat, time_reshaped], axis=1)
-          last_known=last_known_input[-3:]
-          final_array = np.vstack([last_known, concatenated])
-          pred, sal_map=generate_map(np.expand_dims(final_array, axis=0), model)
-          maps.append(sal_map)
-          predictions.append(tf.reshape(pred, shape=[-1]))
-
-        elif _==2:
-          redundant_pred=predictions
-          pca_feat=pca.transform(redundant_pred)
-          time=time_features[:2]
-          concatenated = np.concatenate([pca_feat, time], axis=1)
-          last_known=last_known_input[-2:]
-          final_array = np.vstack([last_known, concatenated])
-          pred, sal_map=generate_map(np.expand_dims(final_array, axis=0), model)
-          maps.append(sal_map)
-          predictions.append(tf.reshape(pred, shape=[-1]))
-          
-        elif _==3:
-          redundant_pred=predictions
-          pca_feat=pca.transform(redundant_pred)
-          time=time_features[:3]
-          concatenated = np.concatenate([pca_feat, time], axis=1)
-          last_known=last_known_input[-1:]
-          final_array = np.vstack([last_known, concatenated])
-          pred, sal_map=generate_map(np.expand_dims(final_array, axis=0), model)
-          maps.append(sal_map)
-          predictions.append(tf.reshape(pred, shape=[-1]))
-
-        else:
-          redundant_pred=predictions[-4:]
-          pca_feat=pca.transform(redundant_pred)
-          time=time_features[(_-3):_+1, :]
-          concatenated = np.concatenate([pca_feat, time], axis=1)
-          pred, sal_map=generate_map(np.expand_dims(concatenated, axis=0), model)
-          maps.append(sal_map)
-          predictions.append(tf.reshape(pred, shape=[-1]))
+    # ring buffer: seed window followed by one row per prediction made so far, last 4 kept
+    start=len(predictions)
+    seed_rows=[np.asarray(row, dtype=np.float32) for row in last_known_input]
+    made_rows=[np.concatenate([pca_feats[j], time_features[j]]) for j in range(max(0, start-4), start)]
+    ring=np.array((seed_rows+made_rows)[-4:], dtype=np.float32)
+    head=0                       # index of the oldest row
+    order=np.arange(4)
+
+    for _ in range(start, n_steps):
+        window=ring[(head+order)%4]
+        if _ >= 4:
+          # from step 4 on the model has always been fed the time features of
+          # quarters _-3 … _ alongside the last four projected predictions
+          window[:, n_pca:]=time_features[(_-3):_+1, :]
+
+        pred=np.asarray(tf.reshape(predict_step(np.expand_dims(window, axis=0), model), [-1]))
+        pca_feat=project(projection, pred)
+
+        ring[head, :n_pca]=pca_feat
+        ring[head, n_pca:]=time_features[_]
+        head=(head+1)%4
+
+        windows.append(window)
+        pca_feats.append(pca_feat)
+        predictions.append(pred)
           
-    return np.array(predictions), maps
+    return np.array(predictions), windows, pca_feats
+
+
+# ────────────────────────────────────────────────────────────────────
+# Ensembles: N perturbed trajectories rolled out together, one batched
+# forward pass per quarter, summarised as per-quarter percentile bands.
+# ────────────────────────────────────────────────────────────────────
+ENSEMBLE_MAX_MEMBERS=512
+ENSEMBLE_PERTURBATIONS=("input", "time")
+ENSEMBLE_METRICS=['c1_dist', 'c2_dist', 'c3_dist', 'c4_dist', 'c7_dist', 'c8_dist', 'bend_1', 'bend_2', 'bend_3']
+
+
+def predict_meandering_ensemble(model, last_known_input, n_steps, pca, years, quarters, scaler_year,
+                                n_members, noise_std, perturb="input", seed=None):
+  """
+  Roll out n_members trajectories as one (n_members, 4, 6) batch per step.
+  perturb="input" adds N(0, noise_std) noise to each member's initial window;
+  perturb="time" adds it to each member's time features at every step.
+  Windows are built exactly as in predict_meandering. Returns (n_members, n_steps, 6).
+  """
+  if perturb not in ENSEMBLE_PERTURBATIONS:
+    raise ValueError(f"perturb must be one of {', '.join(ENSEMBLE_PERTURBATIONS)}")
+  rng=np.random.default_rng(seed)
+
+  time_df=add_time_features(pd.DataFrame({'year': years, 'quarter': quarters}), scaler_year)
+  time_features=np.broadcast_to(time_df[['quarter_sin', 'quarter_cos', 'year_scaled']].values.astype(np.float32),
+                                (n_members, n_steps, 3))
+  ring=np.broadcast_to(np.asarray(last_known_input, dtype=np.float32), (n_members, 4, 6)).copy()
+  if perturb=="input":
+    ring+=rng.normal(0.0, noise_std, ring.shape).astype(np.float32)
+  else:
+    time_features=time_features+rng.normal(0.0, noise_std, time_features.shape).astype(np.float32)
+
+  projection=pca_projection(pca)
+  n_pca=projection[1].shape[1]
+  model=intialize_model(model=model)
+
+  head=0
+  order=np.arange(4)
+  predictions=[]
+  for _ in range(n_steps):
+    windows=ring[:, (head+order)%4]
+    if _ >= 4:
+      windows[:, :, n_pca:]=time_features[:, (_-3):_+1]
+
+    preds=np.asarray(predict_step(windows, model)).reshape(n_members, -1)
+
+    ring[:, head, :n_pca]=project(projection, preds)
+    ring[:, head, n_pca:]=time_features[:, _]
+    head=(head+1)%4
+    predictions.append(preds)
+
+  return np.stack(predictions, axis=1)
+
+
+def meander_ensemble(year, quarter, n_members=100, noise_std=0.05, perturb="input",
+                     percentiles=(5, 50, 95), seed=None):
+  """
+  Per-quarter percentile bands (2025-Q1 … year-Q quarter) of every cX_dist and
+  bend metric over an ensemble of perturbed rollouts, in the same units as
+  return_to_hp: metres, offset from the first observed quarter.
+  """
+  years, quarters, n_steps=get_new_time(year, quarter)
+  scaled=predict_meandering_ensemble(
+    get_model("meander_model"), get_model("meander_last_known_input"), n_steps,
+    get_model("meander_pca"), years, quarters, get_model("scaler_year"),
+    n_members, noise_std, perturb=perturb, seed=seed)
+
+  unscaled=get_model("meander_scaler_ts").inverse_transform(scaled.reshape(-1, scaled.shape[-1])).reshape(scaled.shape)
+  dists=(unscaled/12)*0.625-get_model("meander_init_values")[ENSEMBLE_METRICS[:6]].values.astype(float)
+  bends=np.abs(dists[..., [0, 2, 4]]-dists[..., [1, 3, 5]])
+  bands=np.percentile(np.concatenate([dists, bends], axis=-1), percentiles, axis=0)   # (P, n_steps, 9)
+
+  rows=[]
+  for i, (y, q) in enumerate(zip(years, quarters)):
+    row={'year': y, 'quarter': q}
+    for j, metric in enumerate(ENSEMBLE_METRICS):
+      row[metric]={f'p{p:g}': round(float(bands[k, i, j]), 4) for k, p in enumerate(percentiles)}
+    rows.append(row)
+  return rows
+
+
+# ────────────────────────────────────────────────────────────────────
+# Rollout store: the longest rollout computed so far. Any target at or
+# before its end is a slice; a later target continues from its last step.
+# With a shared cache backend the store is also published there, so every
+# worker continues from (and explains) the furthest rollout any of them made.
+# ────────────────────────────────────────────────────────────────────
+_rollout = None
+_rollout_lock = threading.Lock()
+
+
+def rollout_version():
+  """Version of the models/inputs a rollout (and its saliency maps) was computed from."""
+  return f'{model_version("meander_model")}:{model_version("meander_pca")}:{model_version("meander_last_known_input")}'
+
+
+def _empty_rollout(version):
+  return {"version": version, "predictions": [], "windows": [], "pca_feats": [],
+          "saliency": np.empty((0, 4, 6), dtype=np.float32)}
+
+
+def _current_rollout(n_steps, saliency=False):
+  """
+  The local rollout for the current model version. When it is shorter than
+  n_steps (or lacks saliency for them) it is replaced by the shared one if
+  another worker got further.
+  """
+  global _rollout
+  version=rollout_version()
+  if _rollout is None or _rollout["version"]!=version:
+    _rollout=_empty_rollout(version)
+  covered=len(_rollout["saliency"] if saliency else _rollout["predictions"])
+  if not shared_cache.shared or covered >= n_steps:
+    return _rollout
+
+  entry=shared_cache.get(versioned_key("meander_rollout", version))
+  if entry is not None:
+    arrays, _=entry
+    progress=(len(arrays["predictions"]), len(arrays["saliency"]))
+    if progress > (len(_rollout["predictions"]), len(_rollout["saliency"])):
+      _rollout={"version": version, "predictions": list(arrays["predictions"]),
+                "windows": list(arrays["windows"]), "pca_feats": list(arrays["pca_feats"]),
+                "saliency": arrays["saliency"]}
+  return _rollout
+
+
+def _publish_rollout(rollout):
+  """Write the rollout to the shared cache unless another worker already stored a longer one."""
+  if not shared_cache.shared:
+    return
+  key=versioned_key("meander_rollout", rollout["version"])
+  entry=shared_cache.get(key)
+  # two workers may race here; both write prefixes of the same deterministic rollout
+  if entry is not None and (len(entry[0]["predictions"]), len(entry[0]["saliency"])) >= \
+      (len(rollout["predictions"]), len(rollout["saliency"])):
+    return
+  n=len(rollout["predictions"])
+  shared_cache.set(key, {
+    "predictions": np.asarray(rollout["predictions"]),
+    "windows": np.asarray(rollout["windows"], dtype=np.float32).reshape(n, 4, 6),
+    "pca_feats": np.asarray(rollout["pca_feats"]).reshape(n, -1),
+    "saliency": np.asarray(rollout["saliency"], dtype=np.float32)})
+
+
+def get_rollout(n_steps):
+  """Return predictions[:n_steps], extending the stored rollout if needed."""
+  global _rollout
+  with _rollout_lock:
+    rollout=_current_rollout(n_steps)
+
+    if len(rollout["predictions"]) < n_steps:
+      years, quarters=time_for_steps(n_steps)
+      predictions, windows, pca_feats=predict_meandering(
+        get_model("meander_model"), get_model("meander_last_known_input"), n_steps,
+        get_model("meander_pca"), years, quarters, get_model("scaler_year"),
+        predictions=rollout["predictions"], windows=rollout["windows"],
+        pca_feats=rollout["pca_feats"])
+      _rollout=rollout=dict(rollout, predictions=list(predictions), windows=windows, pca_feats=pca_feats)
+      _publish_rollout(rollout)
+
+    return np.array(rollout["predictions"][:n_steps])
+
+
+def get_saliency_maps(n_steps):
+  """
+  Saliency maps (n_steps, 4, 6) for the first n_steps of the stored rollout.
+  Maps not computed yet are filled in with one batched gradient call.
+  None if a rollout that long was not predicted yet.
+  """
+  with _rollout_lock:
+    rollout=_current_rollout(n_steps, saliency=True)
+    if len(rollout["windows"]) < n_steps:
+      return None
+    done=len(rollout["saliency"])
+    if done < n_steps:
+      new_maps=generate_maps_batch(np.stack(rollout["windows"][done:n_steps]), get_model("meander_model"))
+      rollout["saliency"]=np.concatenate([rollout["saliency"], new_maps.astype(np.float32)])
+      _publish_rollout(rollout)
+    return rollout["saliency"][:n_steps]
+
+
+def get_raw_distances(year, quarter):
+  """
+  Forecast centerline distances in pixel units (unscaled / 12) for every quarter
+  from 2025-Q1 to (year, quarter): (years, quarters, array of shape (n_quarters, 6)).
+  """
+  years, quarters, n_steps=get_new_time(year, quarter)
+  unscaled_predictions=get_model("meander_scaler_ts").inverse_transform(get_rollout(n_steps))
+  return years, quarters, unscaled_predictions/12
+
+
+def get_saliency_map(n_steps, idx):
+  """Saliency map for timestep idx of a rollout of n_steps (None if not predicted yet)."""
+  maps=get_saliency_maps(n_steps)
+  return None if maps is None else maps[idx]
+
 
 def get_past_meandering_values(df, target_year, target_quarter):
-  df['year'] = df['name'].apply(lambda x: int(x.split('-')[0]))
-  df['quarter'] = df['name'].apply(lambda x: int(x.split('-')[1]))
+  parts = df['name'].str.split('-', n=1, expand=True).astype(np.int64)
+  df['year'] = parts[0].to_numpy()
+  df['quarter'] = parts[1].to_numpy()
 
   columns_to_drop = ['name', 'c5_dist', 'c6_dist']
   df.drop(columns=[col for col in columns_to_drop if col in df.columns], inplace=True)
@@ -148,25 +330,36 @@ def get_past_meandering_values(df, target_year, target_quarter):
       filtered_df['bend_3'] = np.abs((filtered_df['c7_dist'] - filtered_df['c8_dist']).astype(float).round(4))
   return filtered_df
 
+
+def _load_meander_history():
+  """
+  The whole observed series, parsed once: offsets from the first quarter and
+  bend metrics precomputed, rows sorted by the (year, quarter) ordinal.
+  """
+  raw=pd.read_csv(past_migration_vals, index_col=0)
+  parts=raw['name'].str.split('-', n=1, expand=True).astype(np.int64)
+  ordinals=(parts[0]*4+parts[1]-1).to_numpy()
+  if np.any(np.diff(ordinals) < 0):
+    raw=raw.iloc[np.argsort(ordinals, kind='stable')]
+    ordinals=np.sort(ordinals, kind='stable')
+  table=get_past_meandering_values(raw, int(ordinals[-1]//4), 4).reset_index(drop=True)
+  return {"ordinals": ordinals, "table": table}
+
+register_model("meander_history", _load_meander_history, paths=[past_migration_vals])
+
+
+def get_past_meandering_history(year, quarter):
+  """Observed rows up to and including (year, quarter): a binary-search prefix of the preparsed table."""
+  history=get_model("meander_history")
+  end=int(np.searchsorted(history["ordinals"], year*4+quarter-1, side='right'))
+  return history["table"].iloc[:end]
+
 def return_to_hp(year, quarter):
   if year>2024:
     try:
-      cache_key=f'{year}_{quarter}'
-      
-      cached_data=m_cache.get(cache_key)
-      
-      if cached_data is not None:
-        predictions, maps=cached_data
-        years, quarters, n_steps=get_new_time(year, quarter)
-
-      else:
-        years, quarters, n_steps=get_new_time(year, quarter)
-        predictions, maps= predict_meandering(model, last_known_input, n_steps, pca, years, quarters, scaler_year)
-        m_cache.set(cache_key, (predictions, maps))
-      unscaled_predictions = scaler_ts.inverse_transform(predictions)
-
-      # the raw predicitons to do post processing for the standard overlay image 
-      raw_df = pd.DataFrame(unscaled_predictions / 12, dtype=float, columns=['c1_dist', 'c2_dist', 'c3_dist', 'c4_dist', 'c7_dist', 'c8_dist'])  
+      years, quarters, n_steps=get_new_time(year, quarter)
+      predictions=get_rollout(n_steps)
+      unscaled_predictions = get_model("meander_scaler_ts").inverse_transform(predictions)
 
       # predictions converted to meters for the table
       transformed_predictions = (unscaled_predictions / 12) * 0.625
@@ -176,9 +369,7 @@ def return_to_hp(year, quarter):
       for i, col in enumerate(targets):
         predictions_df[col] = transformed_predictions[:, i]
 
-      data_cache.set(cache_key, raw_df)
-
-      predictions_df[targets] = predictions_df[targets] - inti_values[targets].values
+      predictions_df[targets] = predictions_df[targets] - get_model("meander_init_values")[targets].values
       predictions_df[targets] = predictions_df[targets].astype(float).round(4)
 
       predictions_df['bend_1'] = np.abs((predictions_df['c1_dist'] - predictions_df['c2_dist']).astype(float).round(4))
@@ -190,8 +381,7 @@ def return_to_hp(year, quarter):
     except Exception as e:
       return f'no predictions generated due to \n{e}'
   else:
-    past_vals=pd.read_csv(past_migration_vals, index_col=0)
-    return get_past_meandering_values(past_vals, year, quarter)
+    return get_past_meandering_history(year, quarter)
   
 
 
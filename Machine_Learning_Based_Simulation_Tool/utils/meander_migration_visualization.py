@@ -1,10 +1,11 @@
 import numpy as np
-from utils.com_cache import data_cache
+from utils.model_registry import register_model, get_model
+from utils.meander_migration import get_raw_distances
 
-latitudes=r'data_dir\y_coords_7.5m.npy'
-longitudes=r'data_dir\x_coords_7.5m.npy'
-latitudes=np.load(latitudes)
-longitudes=np.load(longitudes)
+latitudes_path=r'data_dir\y_coords_7.5m.npy'
+longitudes_path=r'data_dir\x_coords_7.5m.npy'
+
+register_model("lat_long_grids", lambda: (np.load(latitudes_path), np.load(longitudes_path)))
 
 x1, y1 = 497, 305
 x2, y2 = 513, 298
@@ -14,78 +15,75 @@ m = (y2 - y1) / (x2 - x1)
 c = y1 - m * x1
 
 
+# c1, c2, c3, c4, c7, c8 are measured from these control points (pixel row, col)
+control_points_std=np.array([[248, 309], [236, 309], [409, 330], [409, 344], [533, 374], [548, 383], [497, 305], [513, 298]])
+CENTERLINE_POINTS=['c1_dist', 'c2_dist', 'c3_dist', 'c4_dist', 'c7_dist', 'c8_dist']
+
+
 def get_perpendicular_point(known_coord, d_shift):
   shifted_coord=d_shift+known_coord
   return shifted_coord
 
 def get_coordinates(x_pix, y_pix):
+  """Latitude / longitude at pixel (x_pix, y_pix); both may be integer arrays of the same shape."""
+  latitudes, longitudes=get_model("lat_long_grids")
   lat=latitudes[x_pix, y_pix]
   long=longitudes[x_pix, y_pix]
 
   return (lat,long)
-  
+
+def centerline_pixels(distances):
+  """
+  (n_quarters, 6) distances (c1, c2, c3, c4, c7, c8; pixel units) to
+  (n_quarters, 6, 2) pixel positions:
+    c1, c2 : shifted along the first axis from their control point's second coordinate
+    c3, c4 : shifted along the second axis from their control point's first coordinate
+    c7, c8 : moved along the y = m·x + c reference line from control points 7 and 8
+  """
+  d=np.atleast_2d(np.asarray(distances, dtype=float))
+  pixels=np.empty(d.shape+(2,))
+
+  base=control_points_std[[0, 1], 1]
+  pixels[:, 0:2, 0]=get_perpendicular_point(base, d[:, 0:2])
+  pixels[:, 0:2, 1]=base
+
+  base=control_points_std[[2, 3], 0]
+  pixels[:, 2:4, 0]=base
+  pixels[:, 2:4, 1]=get_perpendicular_point(base, d[:, 2:4])
+
+  anchors=control_points_std[[6, 7]]
+  dx=np.sqrt(np.square(d[:, 4:6])/np.square(1+np.square(m)))
+  # the smaller of anchor_x ± dx
+  pixels[:, 4:6, 0]=np.abs(anchors[:, 0]-dx)
+  pixels[:, 4:6, 1]=np.abs(anchors[:, 1]+(d[:, 4:6]*m)/np.sqrt(np.square(m)+1))
+  return pixels
+
+def centerline_coordinates(pixels):
+  """(…, 2) pixel positions to (…, 2) [lat, long], truncated to whole pixels like int()."""
+  idx=np.asarray(pixels).astype(np.int64)
+  lat, long=get_coordinates(idx[..., 0], idx[..., 1])
+  return np.stack([lat, long], axis=-1)
+
 def get_raw_predictions(year, quarter):
-  cache_key=f'{year}_{quarter}'
-  raw_df=data_cache.get(cache_key)
-  control_points_std=[[248, 309], [236, 309], [409, 330], [409, 344], [533, 374], [548, 383], [497, 305], [513, 298]]
-  if raw_df is not None:
-    dist_cols = raw_df.select_dtypes(include=['number'])
-    latest_infer = dist_cols.iloc[-1].to_dict()
-
-    new_centerline_points={}
-    centerline_coordinates=[]
-
-    index_mapping = {
-    0: lambda l: [get_perpendicular_point(control_points_std[0][1], l), control_points_std[0][1]],
-    1: lambda l: [get_perpendicular_point(control_points_std[1][1], l), control_points_std[1][1]],
-    2: lambda l: [control_points_std[2][0], get_perpendicular_point(control_points_std[2][0], l)],
-    3: lambda l: [control_points_std[3][0], get_perpendicular_point(control_points_std[3][0], l)]
-    }
-
-    for i, l in enumerate(latest_infer.values()):  
-      if i in index_mapping: 
-          new_centerline_points[i] = index_mapping[i](l)
-
-      if i==4:
-        x_m_1=control_points_std[6][0] + np.sqrt(np.square(l)/np.square((1+np.square(m))))
-        x_m_2=control_points_std[6][0] - np.sqrt(np.square(l)/np.square((1+np.square(m))))
-        xm=0
-        if x_m_1<x_m_2:
-          xm=np.abs(x_m_1)
-        else:
-          xm=np.abs(x_m_2)
-
-        y_m_1=control_points_std[6][1] + ((l*m)/np.sqrt(np.square(m)+1))
-        y_m_2=control_points_std[6][1] + ((l*m)/np.sqrt(np.square(m)+1))
-        ym=0
-        if y_m_1<y_m_2:
-          xm=np.abs(y_m_1)
-        else:
-          xm=np.abs(y_m_2)
-
-        new_centerline_points[i]=[xm,ym]
-
-      if i == 5:
-        x_m_1=control_points_std[7][0] + np.sqrt(np.square(l)/np.square((1+np.square(m))))
-        x_m_2=control_points_std[7][0] - np.sqrt(np.square(l)/np.square((1+np.square(m))))
-        xm=0
-        if x_m_1<x_m_2:
-          xm=np.abs(x_m_1)
-        else:
-          xm=np.abs(x_m_2)
-
-        y_m_1=control_points_std[7][1] + ((l*m)/np.sqrt(np.square(m)+1))
-        y_m_2=control_points_std[7][1] + ((l*m)/np.sqrt(np.square(m)+1))
-        ym=0
-        if y_m_1<y_m_2:
-          xm=np.abs(y_m_1)
-        else:
-          xm=np.abs(y_m_2)
-      
-    for i in new_centerline_points.values():
-      centerline_coordinates.append(get_coordinates(int(i[0]), int(i[1])))
-
-    
-    return centerline_coordinates
-  else:
-    return 'predict first to get point values'
+  """[lat, long] of each centerline point in the last quarter up to (year, quarter), from the rollout store."""
+  _, _, distances=get_raw_distances(year, quarter)
+  if len(distances)==0:
+    return 'no forecast quarters up to the requested date'
+
+  centerline_coordinates_=centerline_coordinates(centerline_pixels(distances[-1]))[0]
+  return [tuple(point) for point in centerline_coordinates_.tolist()]
+
+def get_centerline_trajectory(year, quarter):
+  """
+  Pixel positions and [lat, long] of every centerline point for each forecast
+  quarter from 2025-Q1 to (year, quarter), computed for all quarters at once.
+  """
+  years, quarters, distances=get_raw_distances(year, quarter)
+  pixels=centerline_pixels(distances)
+  return {
+    "year": years,
+    "quarter": quarters,
+    "points": CENTERLINE_POINTS,
+    "pixels": pixels.round(4).tolist(),
+    "coordinates": centerline_coordinates(pixels).tolist(),
+  }
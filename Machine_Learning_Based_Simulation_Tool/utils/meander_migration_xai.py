@@ -1,21 +1,33 @@
-from flask import send_file
+from flask import send_file, Response, jsonify
+import base64
+import hashlib
+from io import BytesIO
 import numpy as np
 import tensorflow as tf
 import os
-from utils.com_cache import m_cache
 from tensorflow.keras.models import clone_model
 
+# figures are drawn with the object-oriented Figure/Agg API, never pyplot:
+# each request owns its figure, so concurrent renders don't share state
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from utils.com_cache import LRUCache
 
-import matplotlib
-matplotlib.use('Agg')  
-import matplotlib.pyplot as plt
-# don't open gui windows bc it interacts with main thread from worker
+SALIENCY_PNG_DPI = int(os.environ.get("SALIENCY_PNG_DPI", 300))
+SALIENCY_IMAGE_CACHE_SIZE = int(os.environ.get("SALIENCY_IMAGE_CACHE_SIZE", 256))
+
+# (rollout version, timestep, dpi) -> (png bytes, etag)
+saliency_image_cache = LRUCache(maxsize=SALIENCY_IMAGE_CACHE_SIZE)
 
 def intialize_model(model):
     input_data = np.random.rand(1, 4, 6).astype(np.float32)
     _ = model(input_data)
     return model
 
+def predict_step(input_data, model):
+    # forward pass only; saliency is computed later, on request, from the stored window
+    return model(tf.convert_to_tensor(input_data))
+
 def generate_map(input_data, model):
     input_data = tf.convert_to_tensor(input_data)
     
@@ -32,47 +44,97 @@ def generate_map(input_data, model):
     
     return predictions, saliency_map
 
-def generate_map_png(sal_map, idx):
-    try:
-        IMAGE_FOLDER = r'data_dir/meander_migration_sal_maps'
-        if not os.path.exists(IMAGE_FOLDER):
-            os.makedirs(IMAGE_FOLDER)
-        
-        img_filename = f'sal_map_timestep{idx}.png'
-        img_path = os.path.join(IMAGE_FOLDER, img_filename)
-        
-        plt.imshow(sal_map, cmap='hot', aspect='auto')
-        plt.colorbar()
-        plt.title(f'Saliency Map for Timestep {idx + 1}')
-        plt.xticks(ticks=np.arange(6), labels=[f'Feat {i+1}' for i in range(6)])
-        plt.yticks(ticks=np.arange(4), labels=[f'Timestep {i+1}' for i in range(4)])
-        plt.xlabel('Features')
-        plt.ylabel('Timesteps')
-        
-        plt.savefig(img_path, dpi=300)
-        plt.close()  # Close the plot to free memory
-        
-        return img_path
-    except Exception as e:
-        return None, f'Could not generate saliency map due to: {str(e)}'
-         
-def clear_images():
-    IMAGE_FOLDER=r'data_dir\meander_migration_sal_maps'
-    images_list=os.listdir(IMAGE_FOLDER)
-    for i in images_list:
-        os.remove(os.path.join(IMAGE_FOLDER,i))        
+def generate_maps_batch(windows, model):
+    """
+    Saliency maps for a stack of input windows (n_steps, 4, 6) from one batched
+    gradient computation. Samples don't interact in the forward pass, so the
+    gradient of the summed predictions w.r.t. each window equals that window's
+    own per-step gradient (what generate_map returns for batch size 1).
+    """
+    input_data = tf.convert_to_tensor(np.asarray(windows, dtype=np.float32))
+
+    with tf.GradientTape(watch_accessed_variables=False) as tape:
+        tape.watch(input_data)
+        predictions = model(input_data)
+        loss = tf.reduce_sum(predictions)
 
+    gradients = tape.gradient(loss, input_data)
+    return tf.abs(gradients).numpy()     # (n_steps, 4, 6)
+
+def generate_map_png(sal_map, idx, dpi=SALIENCY_PNG_DPI):
+    """Render one (4, 6) saliency map and return the encoded PNG bytes."""
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+
+    im = ax.imshow(sal_map, cmap='hot', aspect='auto')
+    fig.colorbar(im, ax=ax)
+    ax.set_title(f'Saliency Map for Timestep {idx + 1}')
+    ax.set_xticks(np.arange(6), labels=[f'Feat {i+1}' for i in range(6)])
+    ax.set_yticks(np.arange(4), labels=[f'Timestep {i+1}' for i in range(4)])
+    ax.set_xlabel('Features')
+    ax.set_ylabel('Timesteps')
+
+    buf = BytesIO()
+    fig.savefig(buf, format='png', dpi=dpi)
+    return buf.getvalue()
+         
 def send_map_to_api(year, quarter, map_idx):
-    cache_key = f'{year}_{quarter}'
-    cached_data = m_cache.get(cache_key)
-    
-    if cached_data:
-        _, maps = cached_data
-        img_path = generate_map_png(maps[map_idx], map_idx)
-        
-        if img_path:
-            return send_file(img_path, mimetype='image/png')
-        else:
-            return 'Failed to generate image', 500
-    else:
-        return 'Predict first to generate saliency map', 404
\ No newline at end of file
+    # imported here: meander_migration imports this module
+    from utils.meander_migration import get_new_time, get_saliency_map, rollout_version
+
+    _, _, n_steps = get_new_time(year, quarter)
+    if not 0 <= map_idx < n_steps:
+        return 'Timestep index out of range', 400
+
+    # a timestep's map depends only on the rollout version, not on the target quarter
+    key = (rollout_version(), map_idx, SALIENCY_PNG_DPI)
+    cached = saliency_image_cache.get(key)
+    if cached is None:
+        sal_map = get_saliency_map(n_steps, map_idx)
+        if sal_map is None:
+            return 'Predict first to generate saliency map', 404
+        try:
+            png = generate_map_png(sal_map, map_idx)
+        except Exception as e:
+            return f'Could not generate saliency map due to: {str(e)}', 500
+        cached = (png, hashlib.sha1(png).hexdigest())
+        saliency_image_cache.set(key, cached)
+
+    png, etag = cached
+    # strong ETag; send_file answers a matching If-None-Match with 304
+    return send_file(BytesIO(png), mimetype='image/png', etag=etag, conditional=True, max_age=0)
+
+SALIENCY_TENSOR_FORMATS = ("json", "binary")
+
+def send_saliency_tensor(year, quarter, start=0, stop=None, fmt="json"):
+    """
+    Saliency maps for timesteps [start, stop) of the rollout up to (year, quarter)
+    as one little-endian float32 array of shape (stop - start, 4, 6).
+    json  : {"shape", "dtype", "start", "data": base64 of the array bytes}
+    binary: the raw bytes, with the shape / dtype / start in X-Array-* headers
+    """
+    from utils.meander_migration import get_new_time, get_saliency_maps
+
+    _, _, n_steps = get_new_time(year, quarter)
+    stop = n_steps if stop is None else stop
+    if not 0 <= start < stop <= n_steps:
+        return f'Timestep range must satisfy 0 <= start < stop <= {n_steps}', 400
+    if fmt not in SALIENCY_TENSOR_FORMATS:
+        return f"format must be one of {', '.join(SALIENCY_TENSOR_FORMATS)}", 400
+
+    # saliency is filled in lazily as a prefix: only compute the steps asked for
+    maps = get_saliency_maps(stop)
+    if maps is None:
+        return 'Predict first to generate saliency map', 404
+    block = np.ascontiguousarray(maps[start:stop], dtype='<f4')
+
+    if fmt == "json":
+        return jsonify({"shape": list(block.shape), "dtype": "float32", "start": start,
+                        "data": base64.b64encode(block.tobytes()).decode("ascii")})
+    return Response(block.tobytes(), mimetype='application/octet-stream', headers={
+        "X-Array-Shape": ",".join(map(str, block.shape)),
+        "X-Array-Dtype": "float32",
+        "X-Array-Start": str(start),
+        "Access-Control-Expose-Headers": "X-Array-Shape, X-Array-Dtype, X-Array-Start",
+    })
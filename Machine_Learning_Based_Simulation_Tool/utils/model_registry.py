@@ -0,0 +1,142 @@
+import hashlib
+import os
+import threading
+import time
+
+try:
+    import psutil
+except ImportError:  # falls back to /proc/self/statm (Linux); None elsewhere
+    psutil = None
+
+# ────────────────────────────────────────────────────────────────────
+# Central registry: every model / scaler bundle is loaded once per
+# process, on first use, and shared by all endpoints.
+# ────────────────────────────────────────────────────────────────────
+
+_LOADERS = {}        # name -> zero-arg callable returning the artifact
+_PATHS = {}          # name -> artifact files the version is derived from
+_ARTIFACTS = {}      # name -> loaded artifact
+_VERSIONS = {}       # name -> version of the loaded artifact
+_STATS = {}          # name -> {"load_seconds": …, "rss_delta_bytes": …}
+_NAME_LOCKS = {}     # name -> lock guarding that artifact's (re)load
+_REGISTRY_LOCK = threading.Lock()
+
+
+def _rss_bytes():
+    if psutil is not None:
+        return psutil.Process(os.getpid()).memory_info().rss
+    try:
+        with open("/proc/self/statm") as fin:
+            resident_pages = int(fin.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+def _artifact_fingerprint(paths):
+    """Short hash of (path, size, mtime) so a retrained artifact gets a new version."""
+    digest = hashlib.sha1()
+    for path in paths:
+        try:
+            st = os.stat(path)
+            digest.update(f"{path}:{st.st_size}:{st.st_mtime_ns}".encode())
+        except OSError:
+            digest.update(f"{path}:missing".encode())
+    return digest.hexdigest()[:12]
+
+
+def register_model(name, loader, paths=()):
+    """
+    Register a zero-argument ``loader`` under ``name``.
+    Nothing is loaded here; the loader runs the first time get_model(name) is called.
+    ``paths`` lists the files the artifact is read from; their size/mtime
+    fingerprint becomes the model version.
+    Registering the same name twice keeps the first loader.
+    """
+    with _REGISTRY_LOCK:
+        if name not in _LOADERS:
+            _LOADERS[name] = loader
+            _PATHS[name] = tuple(paths)
+            _NAME_LOCKS[name] = threading.Lock()
+
+
+def _lock_for(name):
+    try:
+        return _NAME_LOCKS[name]
+    except KeyError:
+        raise KeyError(f"No model registered under '{name}'") from None
+
+
+def _load(name):
+    """Run the loader and record stats and version; caller holds the name lock."""
+    version = _artifact_fingerprint(_PATHS[name]) if _PATHS[name] else None
+
+    rss_before = _rss_bytes()
+    start = time.perf_counter()
+    artifact = _LOADERS[name]()
+    elapsed = time.perf_counter() - start
+    rss_after = _rss_bytes()
+
+    if version is None:
+        # no files to fingerprint: count loads instead
+        version = str(int(_VERSIONS.get(name, "0")) + 1)
+
+    _STATS[name] = {
+        "load_seconds": round(elapsed, 4),
+        "rss_delta_bytes": (rss_after - rss_before) if rss_before is not None else None,
+        "loaded_at": time.time(),
+    }
+    _VERSIONS[name] = version
+    _ARTIFACTS[name] = artifact
+    print(f"Loaded '{name}' (version {version}) in {elapsed:.2f}s")
+    return artifact
+
+
+def get_model(name):
+    """Return the artifact registered under ``name``, loading it exactly once."""
+    artifact = _ARTIFACTS.get(name)
+    if artifact is not None:
+        return artifact
+
+    with _lock_for(name):
+        # another thread may have finished the load while we waited
+        if name in _ARTIFACTS:
+            return _ARTIFACTS[name]
+        return _load(name)
+
+
+def model_version(name):
+    """Version string of the artifact currently served under ``name``."""
+    get_model(name)
+    return _VERSIONS[name]
+
+
+def refresh_model(name):
+    """
+    Reload ``name`` if its artifact files changed on disk since it was loaded.
+    Returns True when a new version was loaded.
+    """
+    with _lock_for(name):
+        if name not in _ARTIFACTS or not _PATHS[name]:
+            return False
+        if _artifact_fingerprint(_PATHS[name]) == _VERSIONS[name]:
+            return False
+        _load(name)
+        return True
+
+
+def is_loaded(name):
+    return name in _ARTIFACTS
+
+
+def model_stats():
+    """Per-model load time, resident-memory delta and version, plus current process RSS."""
+    with _REGISTRY_LOCK:
+        names = list(_LOADERS)
+    return {
+        "process_rss_bytes": _rss_bytes(),
+        "models": {
+            name: dict(_STATS[name], loaded=True, version=_VERSIONS[name]) if name in _STATS else {"loaded": False}
+            for name in names
+        },
+    }
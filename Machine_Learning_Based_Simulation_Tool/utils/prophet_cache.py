@@ -0,0 +1,84 @@
+import glob
+import hashlib
+import os
+import pickle
+
+# ────────────────────────────────────────────────────────────────────
+# Versioned on-disk cache for the Prophet helper models
+# (temperature / humidity / rainfall). Entries are keyed by a hash of
+# prophet_train.csv, so they are refit only when the training data changes.
+# ────────────────────────────────────────────────────────────────────
+
+# bump when the helper model setup below changes, so old pickles are not reused
+HELPER_CACHE_VERSION = 1
+
+HELPER_TARGETS = {
+    "temperature": "Average_Temperature",
+    "humidity": "Average_Humidity",
+    "rainfall": "Rainfall",
+}
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as fin:
+        for chunk in iter(lambda: fin.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def helper_cache_path(cache_dir, train_hash):
+    return os.path.join(cache_dir, f"prophet_helpers_v{HELPER_CACHE_VERSION}_{train_hash[:16]}.pkl")
+
+
+def fit_helper_models(prophet_train):
+    """Fit one daily-seasonal Prophet per helper column present in prophet_train."""
+    from prophet import Prophet
+
+    helpers = {}
+    for name, column in HELPER_TARGETS.items():
+        if column in prophet_train.columns:
+            df = prophet_train[["ds", column]].dropna().rename(columns={column: "y"})
+            helpers[name] = Prophet(daily_seasonality=True).fit(df)
+        else:
+            helpers[name] = None
+    return helpers
+
+
+def load_or_fit_helper_models(prophet_train, train_file, cache_dir):
+    """
+    Return {"temperature": model, "humidity": model, "rainfall": model}.
+    Models are unpickled from cache_dir when a cache entry for the current
+    train_file exists; otherwise they are fitted and written there.
+    """
+    train_hash = file_sha256(train_file)
+    cache_file = helper_cache_path(cache_dir, train_hash)
+
+    if os.path.exists(cache_file):
+        try:
+            with open(cache_file, "rb") as fin:
+                cached = pickle.load(fin)
+            if cached.get("train_sha256") == train_hash:
+                print(f"Loaded Prophet helper models from {cache_file}.")
+                return cached["models"]
+        except Exception as e:
+            print(f"Ignoring unreadable helper model cache {cache_file}: {e}")
+
+    helpers = fit_helper_models(prophet_train)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+    with open(tmp_file, "wb") as fout:
+        pickle.dump({"train_sha256": train_hash, "models": helpers}, fout)
+    os.replace(tmp_file, cache_file)   # atomic, so concurrent workers never read a partial file
+
+    # drop entries for older training data
+    for stale in glob.glob(os.path.join(cache_dir, "prophet_helpers_v*.pkl")):
+        if stale != cache_file:
+            try:
+                os.remove(stale)
+            except OSError:
+                pass
+
+    print(f"Fitted Prophet helper models and cached them to {cache_file}.")
+    return helpers
@@ -0,0 +1,168 @@
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from itertools import product
+
+import numpy as np
+import pandas as pd
+from sklearn.metrics import mean_absolute_error
+from sklearn.model_selection import TimeSeriesSplit
+
+# ────────────────────────────────────────────────────────────────────
+# Prophet hyperparameter search: fold fits spread over a process pool,
+# every (cps, sps, fold) score checkpointed so an interrupted search
+# resumes where it stopped, and optional early pruning of combinations
+# whose first fold is clearly worse than the best first fold so far.
+# ────────────────────────────────────────────────────────────────────
+
+
+def _fit_fold(train_cv, val_cv, regressors, cps, sps):
+    """Fit one CV fold and return its validation MAE (runs in a worker process)."""
+    from prophet import Prophet
+
+    model_cv = Prophet(
+        changepoint_prior_scale=cps,
+        seasonality_prior_scale=sps,
+        daily_seasonality=True
+    )
+    for reg in regressors:
+        model_cv.add_regressor(reg)
+    model_cv.fit(train_cv)
+    forecast_cv = model_cv.predict(val_cv)
+    return mean_absolute_error(val_cv["y"], forecast_cv["yhat"])
+
+
+def _data_fingerprint(prophet_train, regressors):
+    digest = hashlib.sha256(pd.util.hash_pandas_object(prophet_train, index=True).values.tobytes())
+    digest.update(json.dumps(sorted(regressors)).encode())
+    return digest.hexdigest()[:16]
+
+
+def _read_checkpoint(checkpoint_file, fingerprint, prune_factor=None):
+    """
+    Fold scores and pruned combinations recorded for this data fingerprint.
+    Pruning decisions only hold for the prune_factor that made them, so they
+    are ignored when resuming with another factor or with pruning disabled.
+    """
+    scores, pruned = {}, set()
+    if not checkpoint_file or not os.path.exists(checkpoint_file):
+        return scores, pruned
+    with open(checkpoint_file) as fin:
+        for line in fin:
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                continue            # tolerate a line cut short by an interrupted run
+            if rec.get("fingerprint") != fingerprint:
+                continue
+            combo = (rec["cps"], rec["sps"])
+            if rec.get("pruned"):
+                if prune_factor is not None and rec.get("prune_factor") == prune_factor:
+                    pruned.add(combo)
+            else:
+                scores[(combo, rec["fold"])] = rec["mae"]
+    return scores, pruned
+
+
+def _append_checkpoint(checkpoint_file, record):
+    if not checkpoint_file:
+        return
+    with open(checkpoint_file, "a") as fout:
+        fout.write(json.dumps(record) + "\n")
+        fout.flush()
+
+
+def search_prophet_params(prophet_train, regressors, param_grid, n_splits=2,
+                          n_jobs=None, checkpoint_file=None, prune_factor=None):
+    """
+    Grid-search changepoint_prior_scale × seasonality_prior_scale with
+    TimeSeriesSplit CV and return (best_params, best_score).
+
+    n_jobs        : worker processes (None → os.cpu_count(), 1 → run in-process)
+    checkpoint_file: JSON-lines file of fold scores; reused on the next run
+                     as long as the training data and regressors are unchanged
+    prune_factor  : skip the remaining folds of a combination whose first-fold
+                     MAE exceeds prune_factor × the best first-fold MAE so far
+                     (None disables pruning, which reproduces the full search)
+    """
+    regressors = [reg for reg in regressors if reg in prophet_train.columns]
+    combos = list(product(param_grid["changepoint_prior_scale"], param_grid["seasonality_prior_scale"]))
+    folds = list(TimeSeriesSplit(n_splits=n_splits).split(prophet_train))
+
+    fingerprint = _data_fingerprint(prophet_train, regressors)
+    scores, pruned = _read_checkpoint(checkpoint_file, fingerprint, prune_factor)
+    if scores or pruned:
+        print(f"Resuming Prophet search: {len(scores)} fold scores, {len(pruned)} pruned combinations on record.")
+
+    def best_first_fold():
+        firsts = [mae for (combo, fold), mae in scores.items() if fold == 0]
+        return min(firsts) if firsts else None
+
+    def should_prune(combo):
+        best = best_first_fold()
+        return best is not None and scores[(combo, 0)] > prune_factor * best
+
+    def record(combo, fold, mae):
+        scores[(combo, fold)] = mae
+        _append_checkpoint(checkpoint_file, {"fingerprint": fingerprint, "cps": combo[0],
+                                             "sps": combo[1], "fold": fold, "mae": mae})
+
+    def prune(combo):
+        pruned.add(combo)
+        _append_checkpoint(checkpoint_file, {"fingerprint": fingerprint, "cps": combo[0],
+                                             "sps": combo[1], "pruned": True, "prune_factor": prune_factor})
+
+    def next_folds(combo):
+        """Folds still to fit for combo; with pruning on, later folds wait for fold 0."""
+        todo = [fold for fold in range(len(folds)) if (combo, fold) not in scores]
+        if combo in pruned or not todo:
+            return []
+        if prune_factor is not None:
+            if (combo, 0) not in scores:
+                return [0]
+            if should_prune(combo):
+                prune(combo)
+                return []
+        return todo
+
+    def fold_args(combo, fold):
+        train_idx, val_idx = folds[fold]
+        return (prophet_train.iloc[train_idx], prophet_train.iloc[val_idx], regressors, combo[0], combo[1])
+
+    n_jobs = n_jobs or os.cpu_count() or 1
+    if n_jobs == 1:
+        for combo in combos:
+            while True:
+                todo = next_folds(combo)
+                if not todo:
+                    break
+                for fold in todo:
+                    record(combo, fold, _fit_fold(*fold_args(combo, fold)))
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+            pending = {}
+            for combo in combos:
+                for fold in next_folds(combo):
+                    pending[pool.submit(_fit_fold, *fold_args(combo, fold))] = (combo, fold)
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    combo, fold = pending.pop(future)
+                    record(combo, fold, future.result())
+                    if fold == 0 and prune_factor is not None:
+                        for next_fold in next_folds(combo):
+                            pending[pool.submit(_fit_fold, *fold_args(combo, next_fold))] = (combo, next_fold)
+
+    # same selection rule as the sequential loop: first combination (in grid order) with the lowest mean MAE
+    best_params, best_score = None, float("inf")
+    for combo in combos:
+        fold_scores = [scores.get((combo, fold)) for fold in range(len(folds))]
+        if combo in pruned or None in fold_scores:
+            continue
+        avg_cv_score = np.mean(fold_scores)
+        if avg_cv_score < best_score:
+            best_score = avg_cv_score
+            best_params = combo
+
+    return best_params, best_score
@@ -1,12 +1,18 @@
 
 from pathlib import Path
 import io, base64
+import os
+from functools import lru_cache
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import joblib
+from sklearn.preprocessing import StandardScaler
 from tensorflow.keras.models import load_model
 from keras.losses import MeanSquaredError
+from utils.model_registry import register_model, get_model, model_version
+from utils.com_cache import LRUCache
+from utils.dense_inference import build_predictor
 # ────────────────────────────────────────────────────────────────────
 # 1.  Paths & globals
 # ────────────────────────────────────────────────────────────────────
@@ -20,6 +26,14 @@ SCALER_TS_PATH = r'data_dir\erosion_scaler_ts.pkl'
 SCALER_YEAR_PATH = r'data_dir\scaler_year.pkl'
 TARGETS = [f"Point_{i}" for i in range(1, 26)]  # 25 outputs
 
+# "keras" (model.predict_on_batch), "numpy" (exported weights) or "tf_function"
+INFERENCE_BACKEND = os.environ.get("RIVERINSIGHT_INFERENCE_BACKEND", "keras")
+
+# memoisation of /predict_erosion: inputs are quantised to these resolutions
+PREDICTION_CACHE_SIZE = int(os.environ.get("EROSION_CACHE_SIZE", 4096))
+RAINFALL_RESOLUTION = float(os.environ.get("EROSION_RAINFALL_RESOLUTION", 0.001))
+TEMPERATURE_RESOLUTION = float(os.environ.get("EROSION_TEMPERATURE_RESOLUTION", 0.01))
+
 
 def _force_scaler(obj, name=""):
     """
@@ -42,12 +56,8 @@ def _force_scaler(obj, name=""):
     raise TypeError(f"{name} inside preprocessors.pkl is not a scaler "
                     f"(got type={type(obj)})")
 
-# ── load everything ──────────────────────────────────────────────
-def load_resources():
-    model_1 = load_model(MODEL_PATH_1, custom_objects={'mse': MeanSquaredError()})
-    scaler_ts = joblib.load(SCALER_TS_PATH)
-    scaler_year = joblib.load(SCALER_YEAR_PATH)
-    model  = load_model(MODEL_PATH, compile=False)
+# ── loaders (run once, on first use, via the model registry) ─────
+def _load_preprocessors():
     bundle = joblib.load(BUNDLE_PATH)
 
     # If your pickle is a dict (recommended)
@@ -72,17 +82,42 @@ def load_resources():
 
     scalers = dict(y=scaler_y, year=scaler_year,
                    rain=scaler_rain, temp=scaler_temp)
+    return scalers, feature_cols
+
+
+register_model("riverwidth_nn", lambda: load_model(MODEL_PATH, compile=False), paths=[MODEL_PATH])
+register_model("erosion_preprocessors", _load_preprocessors, paths=[BUNDLE_PATH])
+register_model("erosion_nn", lambda: load_model(MODEL_PATH_1, custom_objects={'mse': MeanSquaredError()}),
+               paths=[MODEL_PATH_1])
+register_model("erosion_scaler_ts", lambda: joblib.load(SCALER_TS_PATH), paths=[SCALER_TS_PATH])
+register_model("scaler_year", lambda: joblib.load(SCALER_YEAR_PATH), paths=[SCALER_YEAR_PATH])
+@lru_cache(maxsize=4)
+def _dense_predictor(model):
+    """
+    Forward-pass callable for one loaded Keras model, built once per model object:
+    when /models/refresh reloads the model, the next call builds a new predictor.
+    """
+    return build_predictor(model, INFERENCE_BACKEND)
+
 
-    return model, scalers, feature_cols,model_1, scaler_ts, scaler_year
+def predict_dense(name, features):
+    """Forward pass of dense model ``name`` through the configured inference backend."""
+    return _dense_predictor(get_model(name))(features)
 
-MODEL, SCALERS, FEATURE_COLS,MODEL_1, SCALER_TS, SCALER_YEAR = load_resources()   # load once at import
+
+# ── load everything ──────────────────────────────────────────────
+def load_resources():
+    """Return the erosion artifacts; each one is deserialised only once per process."""
+    scalers, feature_cols = get_model("erosion_preprocessors")
+    return (get_model("riverwidth_nn"), scalers, feature_cols,
+            get_model("erosion_nn"), get_model("erosion_scaler_ts"), get_model("scaler_year"))
 
 
 # ────────────────────────────────────────────────────────────────────
 # 3.  Feature builder
 # ────────────────────────────────────────────────────────────────────
 def prepare_future_input(year, quarter, rainfall, temperature):
-    """Return a (1, n_features) NumPy array ready for MODEL.predict()."""
+    """Return a (1, n_features) NumPy array ready for the width model's predict()."""
     df = pd.DataFrame({
         "year"       : [year],
         "quarter"    : [quarter],
@@ -94,18 +129,83 @@ def prepare_future_input(year, quarter, rainfall, temperature):
     df["quarter_sin"] = np.sin(2*np.pi*df["quarter"]/4)
     df["quarter_cos"] = np.cos(2*np.pi*df["quarter"]/4)
 
+    scalers, feature_cols = get_model("erosion_preprocessors")
+
     # Scaled & amplified year
-    df["year_scaled"]           = SCALERS["year"].transform(df[["year"]])
+    df["year_scaled"]           = scalers["year"].transform(df[["year"]])
     df["year_scaled_amplified"] = df["year_scaled"] * 10
     df["year_quarter_interaction"] = (
         df["year_scaled_amplified"] * (df["quarter_sin"] + df["quarter_cos"])
     )
 
     # Scaled meteo features
-    df["rainfall_scaled"]    = SCALERS["rain"].transform(df[["rainfall"]])
-    df["temperature_scaled"] = SCALERS["temp"].transform(df[["temperature"]])
+    df["rainfall_scaled"]    = scalers["rain"].transform(df[["rainfall"]])
+    df["temperature_scaled"] = scalers["temp"].transform(df[["temperature"]])
+
+    return df[feature_cols].values
+
+
+def _standardize(values, scaler):
+    """Apply a fitted StandardScaler to a 1-D array (or tensor) using its mean_/scale_ directly."""
+    if getattr(scaler, "with_mean", True) and getattr(scaler, "mean_", None) is not None:
+        values = values - float(np.ravel(scaler.mean_)[0])
+    if getattr(scaler, "with_std", True) and getattr(scaler, "scale_", None) is not None:
+        values = values / float(np.ravel(scaler.scale_)[0])
+    return values
+
+
+def _feature_columns(years, quarters, rainfall, temperature, scalers, sin=np.sin, cos=np.cos):
+    """
+    Every derived column by name. Works on NumPy arrays, or on tensors when
+    tf.sin / tf.cos are passed, so the TF path stays differentiable.
+    """
+    quarter_sin = sin(2*np.pi*quarters/4)
+    quarter_cos = cos(2*np.pi*quarters/4)
+    year_scaled = _standardize(years, scalers["year"])
+    year_scaled_amplified = year_scaled * 10
+
+    return {
+        "year"                    : years,
+        "quarter"                 : quarters,
+        "rainfall"                : rainfall,
+        "temperature"             : temperature,
+        "quarter_sin"             : quarter_sin,
+        "quarter_cos"             : quarter_cos,
+        "year_scaled"             : year_scaled,
+        "year_scaled_amplified"   : year_scaled_amplified,
+        "year_quarter_interaction": year_scaled_amplified * (quarter_sin + quarter_cos),
+        "rainfall_scaled"         : _standardize(rainfall, scalers["rain"]),
+        "temperature_scaled"      : _standardize(temperature, scalers["temp"]),
+    }
+
+
+def _broadcast_raw(years, quarters, rainfall, temperature):
+    return np.broadcast_arrays(
+        *(np.atleast_1d(np.asarray(a, dtype=np.float64)) for a in (years, quarters, rainfall, temperature))
+    )
+
+
+def prepare_future_input_batch(years, quarters, rainfall, temperature):
+    """
+    Vectorised prepare_future_input.
 
-    return df[FEATURE_COLS].values
+    Parameters
+    ----------
+    years, quarters, rainfall, temperature : array-like of shape (N,) or scalars
+        (scalars are broadcast against the arrays)
+
+    Returns
+    -------
+    np.ndarray shape (N, n_features), float32, columns in FEATURE_COLS order
+    """
+    years, quarters, rainfall, temperature = _broadcast_raw(years, quarters, rainfall, temperature)
+    scalers, feature_cols = get_model("erosion_preprocessors")
+
+    columns = _feature_columns(years, quarters, rainfall, temperature, scalers)
+    out = np.empty((years.shape[0], len(feature_cols)), dtype=np.float32)
+    for j, col in enumerate(feature_cols):
+        out[:, j] = columns[col]
+    return out
 
 
 # ────────────────────────────────────────────────────────────────────
@@ -121,84 +221,160 @@ def make_predictions(feature_vec):
     -------
     dict  {Point_1: value, … Point_25: value}
     """
-    y_norm = MODEL.predict(feature_vec)
-    y_orig = SCALERS["y"].inverse_transform(y_norm)[0]   # (25,)
+    scalers, _ = get_model("erosion_preprocessors")
+    y_norm = predict_dense("riverwidth_nn", feature_vec)
+    y_orig = scalers["y"].inverse_transform(y_norm)[0]   # (25,)
     return dict(zip(TARGETS, map(float, y_orig)))
 
 
+# ────────────────────────────────────────────────────────────────────
+# 5.  Memoised predictions
+# ────────────────────────────────────────────────────────────────────
+prediction_cache = LRUCache(maxsize=PREDICTION_CACHE_SIZE)
+_prediction_cache_version = None
+
+
+def _quantise(value, resolution):
+    return round(round(value / resolution) * resolution, 10)
+
+
+def erosion_model_version():
+    """Combined version of everything a width prediction depends on."""
+    return f'{model_version("riverwidth_nn")}:{model_version("erosion_preprocessors")}:{INFERENCE_BACKEND}'
+
+
+def make_predictions_cached(year, quarter, rainfall, temperature):
+    """
+    make_predictions(prepare_future_input(...)) behind a bounded LRU.
+    Rainfall / temperature are quantised to RAINFALL_RESOLUTION /
+    TEMPERATURE_RESOLUTION before both lookup and inference, so every input in
+    a bucket gets the same answer. The cache is cleared when the model version changes.
+    """
+    global _prediction_cache_version
+    version = erosion_model_version()
+    if version != _prediction_cache_version:
+        prediction_cache.clear()
+        _prediction_cache_version = version
+
+    rainfall_q = _quantise(rainfall, RAINFALL_RESOLUTION)
+    temperature_q = _quantise(temperature, TEMPERATURE_RESOLUTION)
+    key = (version, int(year), int(quarter), rainfall_q, temperature_q)
+
+    preds = prediction_cache.get(key)
+    if preds is None:
+        preds = make_predictions(prepare_future_input(year, quarter, rainfall_q, temperature_q))
+        prediction_cache.set(key, preds)
+    return dict(preds)
+
+
+def make_predictions_batch(features):
+    """
+    One forward pass for many rows.
+
+    Parameters
+    ----------
+    features : np.ndarray shape (N, n_features), e.g. from prepare_future_input_batch
+
+    Returns
+    -------
+    np.ndarray shape (N, 25) float64 in original units, columns in TARGETS order
+    """
+    scalers, _ = get_model("erosion_preprocessors")
+    # the network runs in float32; widen before unscaling so callers that
+    # scale/round and .tolist() get clean values (12.345, not 12.345000267...)
+    y_norm = np.asarray(predict_dense("riverwidth_nn", features), dtype=np.float64)
+    return scalers["y"].inverse_transform(y_norm)
+
+
+def quarter_span(start_year, start_quarter, end_year, end_quarter):
+    """(years, quarters) arrays for every quarter from start to end, inclusive."""
+    ordinals = np.arange(start_year*4 + start_quarter - 1, end_year*4 + end_quarter)
+    return ordinals // 4, ordinals % 4 + 1
+
+
 # ------------------------------------------------------------------
-# NEW  generate_feature_sensitivity_heatmap
-#        x-axis = raw features (year, quarter, rainfall, temperature)
-#        y-axis = selected points                 (Point_1 … Point_25)
-#        cell   = Δ-width when that feature nudged upward
+# Feature sensitivity
+#   finite_difference : Δ-width when one raw feature is nudged upward,
+#                       all perturbations in one batched forward pass
+#   jacobian          : exact d(width)/d(raw feature) for all 25 outputs,
+#                       one tf.GradientTape pass (quarter treated as continuous)
 # ------------------------------------------------------------------
-def generate_feature_sensitivity_heatmap(
-    year: int,
-    quarter: int,
-    points: list[int],
+SENSITIVITY_FEATURES = ["year", "quarter", "rainfall", "temperature"]
+
+
+def feature_sensitivity_finite_difference(
+    years, quarters, rainfall, temperature,
     *,
-    rainfall: float,
-    temperature: float,
     delta_year: int = 1,
     delta_quarter: int = 1,
     delta_rain: float = 0.05,
     delta_temp: float = 1.0,
 ):
     """
-    Returns a base-64 PNG that shows, for each chosen point,
-    how much the predicted width changes when *one* raw feature
-    is nudged upward by the supplied deltas.
+    Returns
+    -------
+    base : np.ndarray shape (N, 25)     predictions at the requested inputs
+    sens : np.ndarray shape (N, 25, 4)  change per output when each feature in
+                                        SENSITIVITY_FEATURES is nudged upward
     """
-    # -------- 1. base prediction --------------------------------------------
-    base = make_predictions(
-        prepare_future_input(year, quarter, rainfall, temperature)
-    )
-    base = np.array([base[f"Point_{p}"] for p in points])  # (len(points),)
+    years, quarters, rainfall, temperature = _broadcast_raw(years, quarters, rainfall, temperature)
+    n = years.shape[0]
 
-    # -------- 2. predictions with each feature nudged -----------------------
-    year_up = make_predictions(
-        prepare_future_input(year + delta_year, quarter, rainfall, temperature)
-    )
-    quarter_up = make_predictions(
-        prepare_future_input(year,
-                             ((quarter - 1 + delta_quarter) % 4) + 1,
-                             rainfall, temperature)
-    )
-    rain_up = make_predictions(
-        prepare_future_input(year, quarter, rainfall + delta_rain, temperature)
-    )
-    temp_up = make_predictions(
-        prepare_future_input(year, quarter, rainfall, temperature + delta_temp)
+    # base + one block per nudged feature, stacked into a single (5N, …) batch
+    X = prepare_future_input_batch(
+        np.concatenate([years, years + delta_year, years, years, years]),
+        np.concatenate([quarters, quarters, ((quarters - 1 + delta_quarter) % 4) + 1, quarters, quarters]),
+        np.concatenate([rainfall, rainfall, rainfall, rainfall + delta_rain, rainfall]),
+        np.concatenate([temperature, temperature, temperature, temperature, temperature + delta_temp]),
     )
+    Y = make_predictions_batch(X).reshape(5, n, -1)
+    return Y[0], np.stack([Y[k] - Y[0] for k in range(1, 5)], axis=-1)
 
-    # keep only selected points, shape (len(points),)
-    year_up    = np.array([year_up[f"Point_{p}"]    for p in points])
-    quarter_up = np.array([quarter_up[f"Point_{p}"] for p in points])
-    rain_up    = np.array([rain_up[f"Point_{p}"]    for p in points])
-    temp_up    = np.array([temp_up[f"Point_{p}"]    for p in points])
 
-    # -------- 3. build heat-map DataFrame ------------------------------------
-    diffs = np.vstack([
-        year_up    - base,
-        quarter_up - base,
-        rain_up    - base,
-        temp_up    - base
-    ]).T   # (points, 4)
+def feature_sensitivity_jacobian(years, quarters, rainfall, temperature):
+    """
+    Returns
+    -------
+    base : np.ndarray shape (N, 25)     predictions at the requested inputs
+    jac  : np.ndarray shape (N, 25, 4)  d output / d raw feature, in original units
+    """
+    import tensorflow as tf
 
+    years, quarters, rainfall, temperature = _broadcast_raw(years, quarters, rainfall, temperature)
+    scalers, feature_cols = get_model("erosion_preprocessors")
+    model = get_model("riverwidth_nn")
+
+    raw = tf.constant(np.stack([years, quarters, rainfall, temperature], axis=1), dtype=tf.float32)
+    with tf.GradientTape() as tape:
+        tape.watch(raw)
+        columns = _feature_columns(raw[:, 0], raw[:, 1], raw[:, 2], raw[:, 3], scalers, sin=tf.sin, cos=tf.cos)
+        features = tf.stack([columns[col] for col in feature_cols], axis=1)
+        y_norm = model(features, training=False)
+    jac = tape.batch_jacobian(y_norm, raw).numpy()         # (N, 25, 4), normalised units
+
+    scaler_y = scalers["y"]
+    y_scale = np.ones(jac.shape[1])
+    if getattr(scaler_y, "with_std", True) and getattr(scaler_y, "scale_", None) is not None:
+        y_scale = np.ravel(scaler_y.scale_)
+    base = scaler_y.inverse_transform(y_norm.numpy())
+    return base, jac * y_scale[None, :, None]
+
+
+def render_sensitivity_png(diffs, points, title):
+    """Base-64 PNG heat-map of a (len(points), 4) sensitivity block."""
+    import matplotlib.pyplot as plt, seaborn as sns, io, base64
     df = pd.DataFrame(
         diffs,
         index=[f"Point_{p}" for p in points],
-        columns=["year", "quarter", "rainfall", "temperature"]
+        columns=SENSITIVITY_FEATURES
     )
 
-    # -------- 4. draw heat-map ----------------------------------------------
-    import matplotlib.pyplot as plt, seaborn as sns, io, base64
     fig, ax = plt.subplots(figsize=(6, 0.45*len(points)+1.5))
     sns.heatmap(
         df, ax=ax, cmap="coolwarm", center=0, linewidths=.5,
         cbar_kws=dict(label="Δ width (m) when feature ↑")
     )
-    ax.set_title(f"Sensitivity at {year}-Q{quarter}")
+    ax.set_title(title)
     ax.set_xlabel("Feature nudged upward"); ax.set_ylabel("River point")
     plt.tight_layout()
 
@@ -207,3 +383,29 @@ def generate_feature_sensitivity_heatmap(
     plt.close(fig)
     buf.seek(0)
     return base64.b64encode(buf.getvalue()).decode("utf-8")
+
+
+def generate_feature_sensitivity_heatmap(
+    year: int,
+    quarter: int,
+    points: list[int],
+    *,
+    rainfall: float,
+    temperature: float,
+    delta_year: int = 1,
+    delta_quarter: int = 1,
+    delta_rain: float = 0.05,
+    delta_temp: float = 1.0,
+):
+    """
+    Returns a base-64 PNG that shows, for each chosen point,
+    how much the predicted width changes when *one* raw feature
+    is nudged upward by the supplied deltas.
+    """
+    _, sens = feature_sensitivity_finite_difference(
+        year, quarter, rainfall, temperature,
+        delta_year=delta_year, delta_quarter=delta_quarter,
+        delta_rain=delta_rain, delta_temp=delta_temp,
+    )
+    diffs = sens[0][[p - 1 for p in points]]   # (points, 4)
+    return render_sensitivity_png(diffs, points, f"Sensitivity at {year}-Q{quarter}")
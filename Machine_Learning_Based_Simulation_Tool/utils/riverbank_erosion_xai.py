@@ -3,19 +3,13 @@ import pandas as pd
 import seaborn as sns
 import matplotlib.pyplot as plt
 import tensorflow as tf
-import joblib  # For loading scalers
 import io
 import base64
 
-# Load resources (model and scaler)
-custom_objects = {
-    "mse": tf.keras.losses.MeanSquaredError()
-}
+# The erosion model and year scaler are passed in by the caller; they are
+# owned by the model registry (see utils/riverbank_erosion.py).
 
-model = tf.keras.models.load_model(r"model\erosion_neural_network_model.h5", custom_objects=custom_objects)
-scaler_year = joblib.load(r"data_dir\scaler_year.pkl")
-
-def generate_heatmap_with_timesteps(model, start_year, start_quarter, scaler_year, points, timesteps=5):
+def generate_heatmap_with_timesteps(model, start_year, start_quarter, scaler_year, points, timesteps=5, predict_fn=None):
     """
     Generate a heatmap of predictions over the previous timesteps for specified river points.
 
@@ -26,6 +20,7 @@ def generate_heatmap_with_timesteps(model, start_year, start_quarter, scaler_yea
         scaler_year: Scaler used for the 'year' feature during training.
         points: List of river points to include in the heatmap (e.g., [1, 2, 3]).
         timesteps: Number of timesteps to look back (default=5).
+        predict_fn: Optional fast forward pass (features array -> predictions); defaults to model.predict.
 
     Returns:
         heatmap_image: A base64 string representation of the heatmap image.
@@ -57,7 +52,10 @@ def generate_heatmap_with_timesteps(model, start_year, start_quarter, scaler_yea
     features = timestep_df[feature_cols]
 
     # Predict for all timesteps
-    predictions = model.predict(features)
+    if predict_fn is not None:
+        predictions = predict_fn(features.to_numpy(dtype=np.float32))
+    else:
+        predictions = model.predict(features)
 
     # Extract predictions for the specified points
     heatmap_data = pd.DataFrame(predictions[:, [p - 1 for p in points]], columns=[f"Point_{p}" for p in points])
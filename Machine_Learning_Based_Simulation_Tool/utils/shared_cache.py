@@ -0,0 +1,265 @@
+import hashlib
+import json
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+# ────────────────────────────────────────────────────────────────────
+# Cache shared by the worker processes of one deployment, for NumPy
+# results that are expensive to recompute (the meander rollout). An entry
+# is a dict of arrays plus a small JSON meta dict, stored as a JSON header
+# followed by the raw, aligned array buffers: no pickle on either side.
+#   local : in-process only (single worker; the default)
+#   file  : one file per key under SHARED_CACHE_DIR on the local host
+#   redis : any Redis-compatible server at SHARED_CACHE_URL
+# Keys are built with versioned_key() so a retrained model never reads
+# entries computed by the previous one.
+# ────────────────────────────────────────────────────────────────────
+
+SHARED_CACHE_BACKEND = os.environ.get("RIVERINSIGHT_SHARED_CACHE", "local")
+SHARED_CACHE_DIR = os.environ.get("RIVERINSIGHT_SHARED_CACHE_DIR", os.path.join("data_dir", "shared_cache"))
+SHARED_CACHE_URL = os.environ.get("RIVERINSIGHT_SHARED_CACHE_URL", "redis://localhost:6379/0")
+SHARED_CACHE_MAX_BYTES = int(os.environ.get("RIVERINSIGHT_SHARED_CACHE_MAX_BYTES", 256 << 20))
+SHARED_CACHE_MAX_ENTRY_BYTES = int(os.environ.get("RIVERINSIGHT_SHARED_CACHE_MAX_ENTRY_BYTES", 64 << 20))
+
+_MAGIC = b"RIA1"
+_ALIGN = 64
+
+
+def _aligned(n):
+    return -(-n // _ALIGN) * _ALIGN
+
+
+def versioned_key(namespace, version, *parts):
+    return ":".join([namespace, str(version), *map(str, parts)])
+
+
+def encode_arrays(arrays, meta=None):
+    """Serialise {name: ndarray} (+ meta) as magic | header length | JSON header | array buffers."""
+    arrays = {name: np.ascontiguousarray(arr) for name, arr in arrays.items()}
+    specs, offset = [], 0
+    for name, arr in arrays.items():
+        if arr.dtype.hasobject:
+            raise TypeError(f"'{name}' is an object array and cannot be stored without pickling")
+        specs.append({"name": name, "dtype": arr.dtype.str, "shape": list(arr.shape), "offset": offset})
+        offset += _aligned(arr.nbytes)
+
+    header = json.dumps({"meta": meta or {}, "arrays": specs}).encode()
+    body_start = _aligned(8 + len(header))
+    buf = bytearray(body_start + offset)
+    buf[0:4] = _MAGIC
+    buf[4:8] = struct.pack("<I", len(header))
+    buf[8:8 + len(header)] = header
+    for spec, arr in zip(specs, arrays.values()):
+        start = body_start + spec["offset"]
+        buf[start:start + arr.nbytes] = arr.tobytes()
+    return buf
+
+
+def decode_arrays(data):
+    """Inverse of encode_arrays; arrays are read-only views over ``data``."""
+    view = memoryview(data)
+    if bytes(view[0:4]) != _MAGIC:
+        raise ValueError("not a shared cache entry")
+    (header_len,) = struct.unpack("<I", view[4:8])
+    header = json.loads(bytes(view[8:8 + header_len]))
+    body_start = _aligned(8 + header_len)
+
+    arrays = {}
+    for spec in header["arrays"]:
+        dtype, shape = np.dtype(spec["dtype"]), tuple(spec["shape"])
+        count = int(np.prod(shape, dtype=np.int64))
+        if count == 0:
+            arrays[spec["name"]] = np.empty(shape, dtype=dtype)
+            continue
+        arrays[spec["name"]] = np.frombuffer(view, dtype=dtype, count=count,
+                                             offset=body_start + spec["offset"]).reshape(shape)
+    return arrays, header["meta"]
+
+
+class _ArrayStore:
+    """get/set of encoded array entries; subclasses provide _read/_write of raw bytes."""
+
+    backend = None
+    shared = True         # False when entries are only visible to this process
+
+    def __init__(self, max_bytes=SHARED_CACHE_MAX_BYTES, max_entry_bytes=SHARED_CACHE_MAX_ENTRY_BYTES):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.hits = self.misses = self.rejected = self.errors = 0
+
+    def get(self, key):
+        """(arrays, meta) stored under key, or None."""
+        try:
+            data = self._read(key)
+            entry = decode_arrays(data) if data is not None else None
+        except Exception as e:
+            # the cache only saves work: a broken backend degrades to recomputing
+            print(f"Shared cache read of '{key}' failed: {e}")
+            self.errors += 1
+            entry = None
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return entry
+
+    def set(self, key, arrays, meta=None):
+        """Store arrays under key; returns False if the entry is over max_entry_bytes or the write failed."""
+        data = encode_arrays(arrays, meta)
+        if len(data) > self.max_entry_bytes:
+            self.rejected += 1
+            return False
+        try:
+            self._write(key, data)
+            return True
+        except Exception as e:
+            print(f"Shared cache write of '{key}' failed: {e}")
+            self.errors += 1
+            return False
+
+    def stats(self):
+        return {"backend": self.backend, "hits": self.hits, "misses": self.misses,
+                "rejected": self.rejected, "errors": self.errors,
+                "max_bytes": self.max_bytes, "max_entry_bytes": self.max_entry_bytes}
+
+
+class LocalArrayStore(_ArrayStore):
+    """In-process entries, least recently used evicted beyond max_bytes."""
+
+    backend = "local"
+    shared = False
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._data = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def _read(self, key):
+        with self._lock:
+            data = self._data.get(key)
+            if data is not None:
+                self._data.move_to_end(key)
+            return data
+
+    def _write(self, key, data):
+        data = bytes(data)      # immutable, so decoded arrays stay read-only views
+        with self._lock:
+            old = self._data.pop(key, None)
+            self._size += len(data) - (len(old) if old is not None else 0)
+            self._data[key] = data
+            while self._size > self.max_bytes and len(self._data) > 1:
+                _, evicted = self._data.popitem(last=False)
+                self._size -= len(evicted)
+
+    def stats(self):
+        return dict(super().stats(), entries=len(self._data), bytes=self._size)
+
+
+class FileArrayStore(_ArrayStore):
+    """
+    One file per key in ``directory``, written to a temp file and os.replace'd
+    so readers in other workers never see a partial entry. Reads touch the
+    file's mtime; the oldest files are removed once the directory exceeds max_bytes.
+    """
+
+    backend = "file"
+
+    def __init__(self, directory=SHARED_CACHE_DIR, **kwargs):
+        super().__init__(**kwargs)
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest() + ".bin")
+
+    def _read(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as fin:
+                data = fin.read()
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return data
+
+    def _write(self, key, data):
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as fout:
+            fout.write(data)
+        os.replace(tmp_path, path)
+        self._evict()
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".bin"):
+                try:
+                    st = os.stat(os.path.join(self.directory, name))
+                    entries.append((st.st_mtime, st.st_size, name))
+                except OSError:
+                    pass          # removed by another worker meanwhile
+        return entries
+
+    def _evict(self):
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in entries[:-1]:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+            total -= size
+
+    def stats(self):
+        entries = self._entries()
+        return dict(super().stats(), directory=self.directory, entries=len(entries),
+                    bytes=sum(size for _, size, _ in entries), checked_at=time.time())
+
+
+class RedisArrayStore(_ArrayStore):
+    """Entries in a Redis-compatible server; the server's maxmemory policy bounds the total size."""
+
+    backend = "redis"
+
+    def __init__(self, url=SHARED_CACHE_URL, **kwargs):
+        import redis
+        super().__init__(**kwargs)
+        self.url = url
+        self._client = redis.Redis.from_url(url)
+
+    def _read(self, key):
+        return self._client.get(key)
+
+    def _write(self, key, data):
+        self._client.set(key, bytes(data))
+
+    def stats(self):
+        return dict(super().stats(), url=self.url)
+
+
+def make_shared_cache(backend=SHARED_CACHE_BACKEND):
+    if backend == "file":
+        return FileArrayStore()
+    if backend == "redis":
+        try:
+            return RedisArrayStore()
+        except ImportError as e:
+            print(f"Falling back to the in-process cache: {e}")
+    elif backend != "local":
+        raise ValueError(f"Unknown shared cache backend: {backend}")
+    return LocalArrayStore()
+
+
+shared_cache = make_shared_cache()
@@ -0,0 +1,207 @@
+import hashlib
+import json
+import os
+import time
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+from utils.model_registry import register_model, get_model, model_version
+from utils.prophet_cache import file_sha256
+from utils.simulation_tool import MODEL_PATH, SCALER_FEATURES_PATH, SCALER_TARGETS_PATH  # registers "simulation"
+
+# ────────────────────────────────────────────────────────────────────
+# Response-surface surrogate for the simulation model. An offline build
+# step evaluates the model on a dense (year, quarter, rainfall, temperature)
+# grid and stores the unscaled targets as one float32 tensor
+#   (n_years, 4, n_rainfall, n_temperature, n_targets)
+# which is read into memory on first use. Year and quarter are exact grid
+# indices; rainfall and temperature are interpolated bilinearly. The grid is
+# keyed on a content hash of the model and scaler files, so it stays valid
+# when those files are copied to another machine together with it.
+#
+# Build (from Machine_Learning_Based_Simulation_Tool/):
+#   python -m utils.simulation_surrogate
+# ────────────────────────────────────────────────────────────────────
+
+SURROGATE_FILE = os.path.join("model", "simulation_surrogate.npy")
+SURROGATE_META_FILE = os.path.join("model", "simulation_surrogate.json")
+SURROGATE_FIRST_YEAR = 2025
+SURROGATE_LAST_YEAR = int(os.environ.get("SURROGATE_LAST_YEAR", 2100))
+SURROGATE_RAINFALL_POINTS = int(os.environ.get("SURROGATE_RAINFALL_POINTS", 64))
+SURROGATE_TEMPERATURE_POINTS = int(os.environ.get("SURROGATE_TEMPERATURE_POINTS", 32))
+SURROGATE_ERROR_SAMPLES = 20000
+SURROGATE_PREDICT_CHUNK = 65536
+
+FEATURES = ['year', 'quarter', 'rainfall', 'temperature']
+
+
+@lru_cache(maxsize=4)
+def _simulation_files_sha256(version):
+    digest = hashlib.sha256()
+    for path in (MODEL_PATH, SCALER_FEATURES_PATH, SCALER_TARGETS_PATH):
+        digest.update(file_sha256(path).encode())
+    return digest.hexdigest()
+
+
+def simulation_model_sha256():
+    """
+    SHA-256 over the simulation model and scaler files. Hashed once per
+    model_version (size + mtime), not on every request.
+    """
+    return _simulation_files_sha256(model_version("simulation"))
+
+
+def feature_ranges(scaler_features):
+    """
+    (rainfall, temperature) intervals the grid covers: the fitted range of a
+    MinMaxScaler, otherwise mean ± 3 standard deviations of a StandardScaler.
+    """
+    if hasattr(scaler_features, "data_min_"):
+        lo, hi = scaler_features.data_min_, scaler_features.data_max_
+    else:
+        lo = scaler_features.mean_ - 3 * scaler_features.scale_
+        hi = scaler_features.mean_ + 3 * scaler_features.scale_
+    return (float(lo[0]), float(hi[0])), (float(lo[1]), float(hi[1]))
+
+
+def evaluate_simulation_model(model, scaler_features, scaler_targets, years, quarters, rainfall, temperature):
+    """Unscaled model predictions (N, n_targets) for raw feature columns, predicted in chunks."""
+    data = pd.DataFrame({'year': years, 'quarter': quarters, 'rainfall': rainfall, 'temperature': temperature})
+    data[['rainfall', 'temperature']] = scaler_features.transform(data[['rainfall', 'temperature']])
+    scaled_predictions = np.concatenate([
+        model.predict(data[FEATURES].iloc[start:start + SURROGATE_PREDICT_CHUNK])
+        for start in range(0, len(data), SURROGATE_PREDICT_CHUNK)
+    ])
+    return scaler_targets.inverse_transform(scaled_predictions)
+
+
+def _axis_position(values, lo, hi, n):
+    """Lower grid index and interpolation weight of values on linspace(lo, hi, n)."""
+    position = (np.asarray(values, dtype=np.float64) - lo) / (hi - lo) * (n - 1)
+    i0 = np.clip(np.floor(position).astype(np.int64), 0, n - 2)
+    return i0, np.clip(position - i0, 0.0, 1.0)[:, None]
+
+
+def surrogate_predict(surrogate, years, quarters, rainfall, temperature):
+    """
+    Interpolated predictions (N, n_targets) and a boolean mask of the rows
+    that lie inside the grid (rows outside are clamped to its edge).
+    """
+    grid, meta = surrogate["grid"], surrogate["meta"]
+    years = np.asarray(years, dtype=np.int64)
+    quarters = np.asarray(quarters, dtype=np.int64)
+    rainfall = np.asarray(rainfall, dtype=np.float64)
+    temperature = np.asarray(temperature, dtype=np.float64)
+    (r_lo, r_hi, n_r), (t_lo, t_hi, n_t) = meta["rainfall"], meta["temperature"]
+
+    year_idx = years - meta["first_year"]
+    inside = ((year_idx >= 0) & (year_idx < grid.shape[0]) & (quarters >= 1) & (quarters <= 4)
+              & (rainfall >= r_lo) & (rainfall <= r_hi) & (temperature >= t_lo) & (temperature <= t_hi))
+    year_idx = np.clip(year_idx, 0, grid.shape[0] - 1)
+    quarter_idx = np.clip(quarters - 1, 0, 3)
+
+    ri, wr = _axis_position(rainfall, r_lo, r_hi, n_r)
+    ti, wt = _axis_position(temperature, t_lo, t_hi, n_t)
+    corner = lambda dr, dt: grid[year_idx, quarter_idx, ri + dr, ti + dt].astype(np.float64)
+    predictions = (corner(0, 0) * (1 - wr) * (1 - wt) + corner(1, 0) * wr * (1 - wt)
+                   + corner(0, 1) * (1 - wr) * wt + corner(1, 1) * wr * wt)
+    return predictions, inside
+
+
+def build_surrogate(model, scaler_features, scaler_targets, first_year=SURROGATE_FIRST_YEAR,
+                    last_year=SURROGATE_LAST_YEAR, n_rainfall=SURROGATE_RAINFALL_POINTS,
+                    n_temperature=SURROGATE_TEMPERATURE_POINTS, error_samples=SURROGATE_ERROR_SAMPLES, seed=0):
+    """
+    Evaluate the model on the full grid and measure the interpolation error
+    against the model at error_samples random off-grid points.
+    Returns (grid, meta).
+    """
+    (r_lo, r_hi), (t_lo, t_hi) = feature_ranges(scaler_features)
+    years = np.arange(first_year, last_year + 1)
+    rainfall = np.linspace(r_lo, r_hi, n_rainfall)
+    temperature = np.linspace(t_lo, t_hi, n_temperature)
+
+    Y, Q, R, T = np.meshgrid(years, np.arange(1, 5), rainfall, temperature, indexing="ij")
+    values = evaluate_simulation_model(model, scaler_features, scaler_targets,
+                                       Y.ravel(), Q.ravel(), R.ravel(), T.ravel())
+    grid = values.reshape(Y.shape + (values.shape[-1],)).astype(np.float32)
+
+    meta = {
+        "first_year": int(first_year),
+        "rainfall": [r_lo, r_hi, int(n_rainfall)],
+        "temperature": [t_lo, t_hi, int(n_temperature)],
+        "n_targets": int(grid.shape[-1]),
+        "model_sha256": simulation_model_sha256(),
+        "built_at": time.time(),
+    }
+
+    rng = np.random.default_rng(seed)
+    sample = (rng.integers(first_year, last_year + 1, error_samples), rng.integers(1, 5, error_samples),
+              rng.uniform(r_lo, r_hi, error_samples), rng.uniform(t_lo, t_hi, error_samples))
+    exact = evaluate_simulation_model(model, scaler_features, scaler_targets, *sample)
+    approx, _ = surrogate_predict({"grid": grid, "meta": meta}, *sample)
+    error = np.max(np.abs(approx - exact), axis=0)
+    meta.update(max_abs_error=float(error.max()), max_abs_error_per_target=error.tolist(),
+                error_samples=int(error_samples))
+    return grid, meta
+
+
+def write_surrogate(grid, meta, grid_file=SURROGATE_FILE, meta_file=SURROGATE_META_FILE):
+    """Write both files via temp files + os.replace so a running app never reads a partial grid."""
+    tmp_grid = f"{grid_file}.{os.getpid()}.tmp.npy"
+    np.save(tmp_grid, grid)
+    os.replace(tmp_grid, grid_file)
+    tmp_meta = f"{meta_file}.{os.getpid()}.tmp"
+    with open(tmp_meta, "w") as fout:
+        json.dump(meta, fout, indent=2)
+    os.replace(tmp_meta, meta_file)
+
+
+def load_surrogate():
+    with open(SURROGATE_META_FILE) as fin:
+        meta = json.load(fin)
+    # read fully rather than memory-mapped: a mapped file cannot be os.replace'd
+    # on Windows, which would make write_surrogate fail while the app runs
+    grid = np.load(SURROGATE_FILE)
+    return {"grid": grid, "meta": meta}
+
+register_model("simulation_surrogate", load_surrogate, paths=[SURROGATE_FILE, SURROGATE_META_FILE])
+
+
+def make_prediction_simulation_surrogate(future_X, scaler_features):
+    """
+    make_prediction_simulation answered from the surrogate grid (same DataFrame).
+    Returns None when there is no surrogate for the current model files or a
+    row lies outside the grid, so the caller can fall back to the model.
+    """
+    try:
+        surrogate = get_model("simulation_surrogate")
+        current_sha256 = simulation_model_sha256()
+    except (OSError, ValueError) as e:
+        print(f"Simulation surrogate unavailable: {e}")
+        return None
+    if surrogate["meta"].get("model_sha256") != current_sha256:
+        print("Simulation surrogate was built for other model files; rebuild it.")
+        return None
+
+    # Ensure all features are numeric
+    future_X[FEATURES] = future_X[FEATURES].apply(pd.to_numeric, errors='coerce')
+    predictions, inside = surrogate_predict(surrogate, future_X['year'], future_X['quarter'],
+                                            future_X['rainfall'], future_X['temperature'])
+    if not inside.all():
+        return None
+
+    # Scale the input features, as in make_prediction_simulation
+    future_X[['rainfall', 'temperature']] = scaler_features.transform(future_X[['rainfall', 'temperature']])
+    future_X['predictions'] = predictions.tolist()
+    return future_X
+
+
+if __name__ == "__main__":
+    model, scaler_features, scaler_targets = get_model("simulation")
+    grid, meta = build_surrogate(model, scaler_features, scaler_targets)
+    write_surrogate(grid, meta)
+    print(f"Wrote {SURROGATE_FILE}: shape {grid.shape}, {grid.nbytes / 2**20:.1f} MiB")
+    print(f"Max interpolation error over {meta['error_samples']} off-grid points: "
+          f"{meta['max_abs_error']:.4g} (per target: {[round(e, 4) for e in meta['max_abs_error_per_target']]})")
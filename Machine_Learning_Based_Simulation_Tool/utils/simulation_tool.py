@@ -7,6 +7,9 @@ from numpyencoder import NumpyEncoder
 from datetime import datetime
 from werkzeug.exceptions import HTTPException
 import joblib
+import os
+from utils.model_registry import register_model, model_version
+from utils.com_cache import LRUCache
 
 # global model
 # with open('Machine_Learning_Based_Simulation_Tool/model/riverinsight_simulation_model.pkl', 'rb') as f:
@@ -30,9 +33,35 @@ def load_resource_simulation():
     with open(SCALER_TARGETS_PATH, 'rb') as f:
         scaler_targets = joblib.load(f)
         # print("Loaded scaler_targets type:", type(scaler_targets))  # Debugging
+
+    # parse the tree ensembles for SHAP once, at load time, instead of per request
+    # (the native backend reads the boosters directly and needs no explainers)
+    from utils.simulation_tool_xai import tree_explainers, SIMULATION_EXPLAIN_BACKEND
+    if SIMULATION_EXPLAIN_BACKEND == "shap":
+        tree_explainers(model)
     
     return model, scaler_features, scaler_targets
 
+register_model("simulation", load_resource_simulation,
+               paths=[MODEL_PATH, SCALER_FEATURES_PATH, SCALER_TARGETS_PATH])
+
+# one estimator per target, in the column order the target scaler was fitted on
+SIMULATION_TARGETS = ['c1_dist', 'c2_dist', 'c3_dist', 'c4_dist', 'c5_dist', 'c6_dist', 'c7_dist', 'c8_dist']
+
+def simulation_target_names(scaler_targets):
+    """
+    Names of the model's outputs in estimator order, read from the fitted
+    target scaler (SIMULATION_TARGETS for a scaler fitted without names).
+    """
+    names = getattr(scaler_targets, 'feature_names_in_', None)
+    return [str(name) for name in names] if names is not None else list(SIMULATION_TARGETS)
+
+SIMULATION_CACHE_SIZE = int(os.environ.get("SIMULATION_CACHE_SIZE", 8192))
+
+# (model version, year, quarter, rainfall, temperature) -> unscaled target row
+simulation_prediction_cache = LRUCache(maxsize=SIMULATION_CACHE_SIZE)
+_simulation_cache_version = None
+
 # def set_quarter_flags(df):
 #     # Create a dictionary of quarters with False values
 #     quarter_flags = {f'quarter_{i}': False for i in range(2, 5)}
@@ -43,43 +72,61 @@ def load_resource_simulation():
 #         df[quarter_flag_column] = df['quarter'].apply(lambda x: True if int(x) == i else False)
 #     return df
 
+def _quarter_counts(dates):
+    """
+    Number of quarters from 2025-Q1 up to each date's quarter. Raises
+    ValueError naming the first scenario whose date is missing, not a
+    YYYY-MM-DD date, or before 2025-Q1.
+    """
+    parsed = pd.to_datetime(pd.Series(dates, dtype=object), format='%Y-%m-%d', errors='coerce')
+    invalid = np.flatnonzero(parsed.isna().to_numpy())
+    if len(invalid):
+        k = int(invalid[0])
+        raise ValueError(f"scenario {k}: date {dates[k]!r} is not a YYYY-MM-DD date")
+    counts = (parsed.dt.year.to_numpy() - 2025) * 4 + (parsed.dt.month.to_numpy() - 1) // 3 + 1
+    early = np.flatnonzero(counts < 1)
+    if len(early):
+        k = int(early[0])
+        raise ValueError(f"scenario {k}: date {dates[k]!r} is before 2025-Q1, the first forecast quarter")
+    return counts.astype(np.int64)
+
 def generate_quarters_range(input_date):
     """
     Generate a list of quarters from 2025-Q1 to the input date's quarter.
     """
-    input_date = datetime.strptime(input_date, '%Y-%m-%d')
-    input_year = input_date.year
-    input_quarter = (input_date.month - 1) // 3 + 1
-
-    quarters = []
-    for year in range(2025, input_year + 1):
-        start_quarter = 1 if year > 2025 else 1  # Start from Q1 for 2025
-        end_quarter = input_quarter if year == input_year else 4  # End at input quarter for the input year
+    steps = np.arange(_quarter_counts([input_date])[0])
+    return list(zip((2025 + steps // 4).tolist(), (steps % 4 + 1).tolist()))
 
-        for quarter in range(start_quarter, end_quarter + 1):
-            quarters.append((year, quarter))
-    
-    return quarters
-
-def prepare_future_input_simulation(date, rainfall, temp):
+def prepare_future_input_simulation_batch(dates, rainfall, temp, max_rows=None):
+    """
+    Input rows for many (date, rainfall, temp) scenarios, stacked in order:
+    scenario k covers 2025-Q1 to dates[k]'s quarter at rainfall[k] / temp[k].
+    Returns (data_df, quarter count of each scenario). Raises ValueError, before
+    building anything, when there would be more than max_rows rows.
+    """
+    counts = _quarter_counts(dates)
+    if max_rows is not None and counts.sum() > max_rows:
+        raise ValueError(f"{counts.sum()} input quarters requested, the limit is {max_rows}")
+    starts = np.cumsum(counts) - counts
+    scenario = np.repeat(np.arange(len(counts)), counts)
+    steps = np.arange(counts.sum()) - starts[scenario]
+    years = 2025 + steps // 4
+    quarters = steps % 4 + 1
+
+    data_df = pd.DataFrame({
+        'date': pd.to_datetime(pd.DataFrame({'year': years, 'month': quarters * 3 - 2, 'day': 1})),  # Start of the quarter
+        'year': years,
+        'quarter': quarters,
+        'rainfall': np.repeat(np.asarray(rainfall, dtype=float), counts),
+        'temperature': np.repeat(np.asarray(temp, dtype=float), counts),
+    })
+    return data_df, counts
+
+def prepare_future_input_simulation(date, rainfall, temp, max_rows=None):
     """
     Prepare input data for the model.
     """
-    quarters = generate_quarters_range(date)
-    data = []
-
-    for year, quarter in quarters:
-        row = {
-            'date': pd.to_datetime(f'{year}-{quarter * 3 - 2}-01'),  # Start of the quarter
-            'year': year,
-            'quarter': quarter,
-            'rainfall': float(rainfall),
-            'temperature': float(temp)
-        }
-        data.append(row)
-
-    data_df = pd.DataFrame(data)
-    print("Input DataFrame before scaling:\n", data_df)
+    data_df, _ = prepare_future_input_simulation_batch([date], [rainfall], [temp], max_rows=max_rows)
     return data_df
 
 # def prepare_future_input_simualtion(date, rainfall, temp):
@@ -138,3 +185,39 @@ def make_prediction_simulation(model, future_X, scaler_features, scaler_targets)
     future_X['predictions'] = predictions.tolist()
     return future_X
 
+
+def make_prediction_simulation_cached(model, future_X, scaler_features, scaler_targets):
+    """
+    make_prediction_simulation with a per-row cache: each quarter depends only on
+    (year, quarter, rainfall, temperature), so only rows not seen before for the
+    current model version go through model.predict. Returns the same DataFrame.
+    """
+    global _simulation_cache_version
+    version = model_version("simulation")
+    if version != _simulation_cache_version:
+        simulation_prediction_cache.clear()
+        _simulation_cache_version = version
+
+    features = ['year', 'quarter', 'rainfall', 'temperature']
+    
+    # Ensure all features are numeric
+    future_X[features] = future_X[features].apply(pd.to_numeric, errors='coerce')
+    keys = [(version, int(year), int(quarter), float(rainfall), float(temp))
+            for year, quarter, rainfall, temp in future_X[features].itertuples(index=False)]
+    
+    # Scale the input features
+    scaled_features = scaler_features.transform(future_X[['rainfall', 'temperature']])
+    future_X[['rainfall', 'temperature']] = scaled_features
+
+    rows = [simulation_prediction_cache.get(key) for key in keys]
+    missing = [i for i, row in enumerate(rows) if row is None]
+    if missing:
+        # rows are independent, so predicting only the missing ones gives the same values
+        scaled_predictions = model.predict(future_X[features].iloc[missing])
+        for i, row in zip(missing, scaler_targets.inverse_transform(scaled_predictions)):
+            rows[i] = row
+            simulation_prediction_cache.set(keys[i], row)
+    
+    # Add predictions to the DataFrame
+    future_X['predictions'] = [row.tolist() for row in rows]
+    return future_X
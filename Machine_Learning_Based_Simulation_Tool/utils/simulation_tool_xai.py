@@ -12,27 +12,106 @@ import numpy as np
 import matplotlib.pyplot as plt
 import seaborn as sns
 from io import BytesIO
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 
+# "native": XGBoost pred_contribs per booster, "shap": shap.TreeExplainer
+SIMULATION_EXPLAIN_BACKENDS = ("native", "shap")
+SIMULATION_EXPLAIN_BACKEND = os.environ.get("SIMULATION_EXPLAIN_BACKEND", "native")
+# targets explained concurrently, and the cores each booster may use for its
+# own TreeSHAP pass, so threads × nthread stays within the machine
+SIMULATION_EXPLAIN_THREADS = int(os.environ.get("SIMULATION_EXPLAIN_THREADS", min(4, os.cpu_count() or 1)))
+SIMULATION_EXPLAIN_NTHREAD = max(1, (os.cpu_count() or 1) // SIMULATION_EXPLAIN_THREADS)
+# worker threads are only started once the native backend is first used
+_contrib_pool = ThreadPoolExecutor(max_workers=SIMULATION_EXPLAIN_THREADS, thread_name_prefix="xgb-contribs")
 
-def calculate_shap_feature_importance(model, data, feature_names):
+
+@lru_cache(maxsize=2)
+def tree_explainers(model):
+    """
+    One shap.TreeExplainer per estimator of the MultiOutputRegressor, built the
+    first time a model is seen and reused for every request after that.
+    """
+    return tuple(shap.TreeExplainer(estimator) for estimator in model.estimators_)
+
+
+@lru_cache(maxsize=2)
+def contrib_boosters(model):
+    """
+    A private copy of each estimator's booster, limited to SIMULATION_EXPLAIN_NTHREAD
+    cores, built once per model: requests only ever read them, and the
+    boosters model.predict uses are left untouched.
+    """
+    boosters = tuple(estimator.get_booster().copy() for estimator in model.estimators_)
+    for booster in boosters:
+        booster.set_param({"nthread": SIMULATION_EXPLAIN_NTHREAD})
+    return boosters
+
+
+def _native_abs_contribs(booster, X):
+    """|contribution| of each feature for each row from XGBoost's own TreeSHAP (pred_contribs)."""
+    import xgboost
+
+    contribs = booster.predict(xgboost.DMatrix(X, nthread=SIMULATION_EXPLAIN_NTHREAD), pred_contribs=True)
+    return np.abs(contribs[:, :-1])     # last column is the bias term
+
+
+def shap_abs_per_target(model, data, feature_names, backend=None):
+    """
+    Absolute SHAP value of each feature, for each target and row: (n_targets, n_rows, n_features).
+    backend "native" asks each XGBoost booster for its exact TreeSHAP contributions
+    (C++; the targets run in a thread pool since it releases the GIL),
+    "shap" goes through the cached shap.TreeExplainers.
+    """
+    backend = backend or SIMULATION_EXPLAIN_BACKEND
+    X = data[feature_names]
+    if backend == "native":
+        try:
+            return np.stack(list(_contrib_pool.map(lambda booster: _native_abs_contribs(booster, X),
+                                                   contrib_boosters(model))))
+        except (ImportError, AttributeError) as e:
+            # not an XGBoost ensemble (or xgboost missing): explain through shap instead
+            print(f"Falling back to shap for simulation feature importance: {e}")
+    elif backend != "shap":
+        raise ValueError(f"explain backend must be one of {', '.join(SIMULATION_EXPLAIN_BACKENDS)}")
+    return np.stack([np.abs(explainer.shap_values(X)) for explainer in tree_explainers(model)])
+
+
+def shap_mean_abs_per_target(model, data, feature_names, backend=None):
+    """Mean absolute SHAP value of each feature for each target: (n_targets, n_features)."""
+    return np.mean(shap_abs_per_target(model, data, feature_names, backend), axis=1)
+
+
+def _importance_percentages(mean_abs_shap_values):
+    return (mean_abs_shap_values / np.sum(mean_abs_shap_values)) * 100
+
+
+def _importance_dict(feature_names, feature_importance_percentages):
+    return {
+        feature: float(round(percentage, 2)) for feature, percentage in zip(feature_names, feature_importance_percentages)
+    }
+
+
+def feature_importance_per_target_dict(feature_names, target_names, mean_abs_shap_values):
+    """{target: {feature: %}} from a (n_targets, n_features) mean |SHAP| matrix, without the heatmap."""
+    return {
+        target_name: _importance_dict(feature_names, _importance_percentages(target_mean_abs))
+        for target_name, target_mean_abs in zip(target_names, mean_abs_shap_values)
+    }
+
+
+def calculate_shap_feature_importance(model, data, feature_names, mean_abs_shap_values=None):
     """
     Calculate SHAP values and compute feature importance percentages.
+    The importance is that of the first estimator; pass its row of
+    shap_mean_abs_per_target as mean_abs_shap_values to skip the SHAP pass.
     """
-    # Extract the underlying XGBRegressor from the MultiOutputRegressor
-    underlying_model = model.estimators_[0]  # Assuming the first estimator is XGBRegressor
-    
-    # Create a SHAP TreeExplainer
-    explainer = shap.TreeExplainer(underlying_model)
-    
-    # Calculate SHAP values
-    shap_values = explainer.shap_values(data[feature_names])
-    
-    # Compute the mean absolute SHAP values for each feature
-    mean_abs_shap_values = np.mean(np.abs(shap_values), axis=0)
+    if mean_abs_shap_values is None:
+        shap_values = tree_explainers(model)[0].shap_values(data[feature_names])
+        mean_abs_shap_values = np.mean(np.abs(shap_values), axis=0)
     
     # Calculate the percentage importance of each feature
-    total_importance = np.sum(mean_abs_shap_values)
-    feature_importance_percentages = (mean_abs_shap_values / total_importance) * 100
+    feature_importance_percentages = _importance_percentages(mean_abs_shap_values)
     
     # Convert to Python float and create a dictionary
     feature_importance_dict = {
@@ -42,7 +121,7 @@ def calculate_shap_feature_importance(model, data, feature_names):
     return feature_importance_dict
 
 
-def calculate_shap_feature_importance_per_target(model, data, feature_names, target_names):
+def calculate_shap_feature_importance_per_target(model, data, feature_names, target_names, mean_abs_shap_values=None):
     """
     Calculate SHAP-based feature importance for each target variable individually and generate a heatmap.
     Returns a base64-encoded image URL for the heatmap.
@@ -52,42 +131,26 @@ def calculate_shap_feature_importance_per_target(model, data, feature_names, tar
         data: The input data (pandas DataFrame).
         feature_names: List of feature names.
         target_names: List of target variable names.
+        mean_abs_shap_values: Optional precomputed shap_mean_abs_per_target(model, data, feature_names).
     
     Returns:
         A dictionary where keys are target names and values are dictionaries of feature importance percentages,
         and a base64-encoded image URL for the heatmap.
     """
+    if mean_abs_shap_values is None:
+        mean_abs_shap_values = shap_mean_abs_per_target(model, data, feature_names)
+
     # Initialize a dictionary to store feature importance for each target
     feature_importance_per_target = {}
 
     # Initialize a matrix to store feature importance values for the heatmap
     heatmap_data = np.zeros((len(target_names), len(feature_names)))
 
-    # Iterate over each target variable
-    for i, target_name in enumerate(target_names):
-        # Extract the underlying model for the current target
-        underlying_model = model.estimators_[i]  # Assuming MultiOutputRegressor
-        
-        # Create a SHAP TreeExplainer for the current target's model
-        explainer = shap.TreeExplainer(underlying_model)
-        
-        # Calculate SHAP values for the current target
-        shap_values = explainer.shap_values(data[feature_names])
-        
-        # Compute the mean absolute SHAP values for each feature
-        mean_abs_shap_values = np.mean(np.abs(shap_values), axis=0)
-        
-        # Calculate the percentage importance of each feature
-        total_importance = np.sum(mean_abs_shap_values)
-        feature_importance_percentages = (mean_abs_shap_values / total_importance) * 100
-        
-        # Convert to Python float and create a dictionary
-        feature_importance_dict = {
-            feature: float(round(percentage, 2)) for feature, percentage in zip(feature_names, feature_importance_percentages)
-        }
+    for i, (target_name, target_mean_abs) in enumerate(zip(target_names, mean_abs_shap_values)):
+        feature_importance_percentages = _importance_percentages(target_mean_abs)
         
         # Store the feature importance dictionary for the current target
-        feature_importance_per_target[target_name] = feature_importance_dict
+        feature_importance_per_target[target_name] = _importance_dict(feature_names, feature_importance_percentages)
         
         # Store the feature importance percentages in the heatmap data matrix
         heatmap_data[i, :] = feature_importance_percentages